@@ -7,7 +7,7 @@ from flasgger import swag_from
 from flask import Blueprint, g, jsonify, request, Response
 from api.utils.wraps import login_required
 from db.docs import Users
-from api import cache
+from api import cache, user_cache
 
 auth = Blueprint("auth", __name__, url_prefix="/api/auth/")
 
@@ -41,6 +41,11 @@ def login_user() -> Response:
             err_res["message"] = "Invalid password"
             return jsonify(err_res), 400
 
+        # work factor changed since the password was last hashed
+        if user.needs_rehash():
+            user.set_password(password)
+            user.save()
+
     api_token = str(uuid.uuid4())
 
     # save to cache
@@ -61,6 +66,7 @@ def logout() -> Response:
     logs out logged in user
     """
     cache.delete(g.token)  # if exists
+    user_cache.invalidate(g.user.username)
 
     res = jsonify()
     res.status_code = 200
@@ -2,6 +2,49 @@
 """
 Module for intializing cache
 """
-from db.cache import RedisConnect
+import redis
+from mongoengine import signals
+from api.utils.config import Config
+from db.cache import ChannelSubscribers, PageCache, RedisConnect, UserCache
+from db.docs import Users
 
 cache = RedisConnect()
+user_cache = UserCache(cache, Config.USER_CACHE_SIZE, Config.USER_CACHE_TTL)
+page_cache = PageCache(
+    cache, Config.PAGE_CACHE_TTL, Config.PAGE_CACHE_LOCK_TIMEOUT)
+subscribers = ChannelSubscribers(cache)
+
+
+def invalidate_user(sender, document, **kwargs) -> None:
+    """
+    drops a saved user (e.g. through Users.update_user) from the user cache
+    """
+    user_cache.invalidate(document.username)
+
+
+def subscribe_user(sender, document, **kwargs) -> None:
+    """
+    keeps the channel subscribers of a saved user (registration,
+    Users.update_user of the field or notifications) up to date
+    Note: the user is saved already, redis errors are left to
+        rebuild-subscribers (and notifications then read the users)
+    """
+    try:
+        subscribers.update(document.to_mongo().to_dict())
+    except redis.RedisError:
+        pass
+
+
+def unsubscribe_user(sender, document, **kwargs) -> None:
+    """
+    drops a deleted user from the channel subscribers
+    """
+    try:
+        subscribers.remove(str(document.id))
+    except redis.RedisError:
+        pass
+
+
+signals.post_save.connect(invalidate_user, sender=Users)
+signals.post_save.connect(subscribe_user, sender=Users)
+signals.post_delete.connect(unsubscribe_user, sender=Users)
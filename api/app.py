@@ -2,8 +2,10 @@
 """
 Module for defining flask core Application
 """
-from api import cache
+from api import page_cache, user_cache
+from api.utils.compression import compress_response
 from api.utils.config import Config
+from api.utils.events import ConnectionLimit, event_broker
 from api.utils.validate import (
     validate_email,
     validate_password,
@@ -14,7 +16,15 @@ from api.utils.wraps import json_required, login_required
 from api.users.endpoints import users_endpoints
 from api.Auth.auth import auth
 from api.channel import channels
-from db.docs import Users, Queries, Notifications, Responses
+from api.commands import cli_commands
+from db.docs import (
+    Users,
+    Queries,
+    Notifications,
+    Responses,
+    ResponsesMoving,
+)
+from db.hashing import HashingPoolBusy, password_hasher
 
 from flask_mongoengine import MongoEngine
 from flask import Flask, g, Response, jsonify, redirect, request, url_for
@@ -27,14 +37,61 @@ app.register_blueprint(users_endpoints)
 app.register_blueprint(auth)
 app.register_blueprint(channels)
 
+for command in cli_commands:
+    app.cli.add_command(command)
+
+app.after_request(compress_response)
+
 mongo = MongoEngine(app)
 swagger = Swagger(app)
 
+password_hasher.configure(
+    rounds=app.config["BCRYPT_ROUNDS"],
+    workers=app.config["BCRYPT_WORKERS"],
+    queue_depth=app.config["BCRYPT_QUEUE_DEPTH"],
+    bulk_workers=app.config["BCRYPT_BULK_WORKERS"],
+)
+event_broker.configure(
+    max_connections=app.config["EVENTS_MAX_CONNECTIONS"],
+    heartbeat=app.config["EVENTS_HEARTBEAT"],
+)
+Queries.responses_storage = app.config["RESPONSES_STORAGE"]
+
 
 err_res = {"status": "error", "message": ""}
 succ_res = {"status": "success", "message": ""}
 
 
+@app.errorhandler(HashingPoolBusy)
+def hashing_pool_busy(error) -> Response:
+    """
+    rejects the request when password hashing is saturated
+    """
+    res = jsonify({"status": "error", "message": "Server busy, try again"})
+    res.headers["Retry-After"] = "1"
+    return res, 503
+
+
+@app.errorhandler(ResponsesMoving)
+def responses_moving(error) -> Response:
+    """
+    rejects a response while the responses of its question are moved
+    """
+    res = jsonify({"status": "error", "message": "Server busy, try again"})
+    res.headers["Retry-After"] = "1"
+    return res, 503
+
+
+@app.errorhandler(ConnectionLimit)
+def event_streams_busy(error) -> Response:
+    """
+    rejects an event stream when the worker serves too many of them
+    """
+    res = jsonify({"status": "error", "message": "Too many event streams"})
+    res.headers["Retry-After"] = str(app.config["EVENTS_HEARTBEAT"])
+    return res, 503
+
+
 @app.route('/', strict_slashes=False)
 @swag_from("../YAML/base/index.yml")
 def index() -> Response:
@@ -51,7 +108,11 @@ def status() -> Response:
     """
     view for status
     """
-    return jsonify({"status": "success"}), 200
+    return jsonify({
+        "status": "success", "user_cache": user_cache.stats(),
+        "page_cache": page_cache.stats(),
+        "event_streams": event_broker.connections(),
+        }), 200
 
 
 @app.route("/register", methods=["POST"], strict_slashes=False)
@@ -135,11 +196,3 @@ def get_general_channel() -> Response:
     return redirect(
         url_for("channel.handle_specific_channel", channel="general")
         )
-
-
-@app.teardown_appcontext
-def close_connection(response_or_error=None) -> None:
-    """
-    Function to close and teardown relevant connections
-    """
-    cache.close()
@@ -3,7 +3,9 @@
 Module for route/index and specific(channel)
 under the channel blueprint
 """
+from api import page_cache
 from api.channel import channels
+from api.utils.conditional import make_etag, not_modified, with_validators
 from flask import g, jsonify, redirect, request, Response, url_for
 from db.docs import Queries
 from api.utils.wraps import login_required, parse_pagination_params
@@ -15,6 +17,37 @@ res = {
 }
 
 
+def channel_page(channel: str) -> Response:
+    """
+    response with the page of questions of a channel (all for every
+        channel) requested by the pagination parameters, served from the
+        page cache
+    Note: the etag derives from the generation of the channel pages, a
+        client holding the current page gets a 304 without any query (no
+        validators are sent while the generation is unknown)
+    """
+    page = None if g.cursor else max(g.page, 1)
+    version = page_cache.version(channel)
+
+    if version:
+        etag = make_etag(channel, version[0], page, g.page_size, g.cursor)
+        cached = not_modified(etag, version[1])
+        if cached:
+            return cached
+
+    def compute() -> dict:
+        queries, paginations_data = Queries.get_queries(
+            channel, g.page, g.page_size, g.cursor)
+        return {"data": queries, **paginations_data}
+
+    response = jsonify({**res, **page_cache.get_or_compute(
+        channel, (page, g.page_size, g.cursor), compute)})
+
+    if version:
+        with_validators(response, etag, version[1])
+    return response
+
+
 @channels.route("/<channel>/", strict_slashes=False)
 @parse_pagination_params
 @login_required
@@ -27,10 +60,7 @@ def handle_specific_channel(channel) -> Response:
     Return (Response): a JSON representation of questions
             posted to the channel with their responses (paginated).
     """
-    queries, paginations_data = Queries.get_queries(
-        channel, g.page, g.page_size)
-
-    return jsonify({**res, "data": queries, **paginations_data}), 200
+    return channel_page(channel)
 
 
 @channels.route("/", strict_slashes=False)
@@ -48,21 +78,24 @@ def root_channel() -> Response:
             as a query parameter.
     """
     err_res = {"status": "error", "message": "Invalid all parameter"}
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     all_query = request.args.get("all", False) or data.get("all", False)
     channel = request.args.get("channel", "developer") or data.get(
         "channel", "developer"
     )
 
     if not all_query:
+        # keep the pagination (page, page_size, cursor) and auth args
+        args = {
+            k: v for k, v in request.args.items()
+            if k not in ("all", "channel")
+            }
         return redirect(
-            url_for("channel.handle_specific_channel", channel=channel)
+            url_for("channel.handle_specific_channel",
+                    channel=channel, **args)
             )
 
-    if type(all) is str and all.lower() is True:
-        queries, pagination_data = Queries.get_queries(
-            channel, g.page, g.page_size
-            )
-        return jsonify({**res, "data": queries, **pagination_data}), 200
+    if str(all_query).lower() == "true":
+        return channel_page("all")
 
     return jsonify(err_res), 400
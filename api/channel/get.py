@@ -2,12 +2,25 @@
 """
 Module for the channels get endpoints
 """
+import json
 from bson import ObjectId, errors
+from datetime import datetime
+from api.utils.search import decode_search_cursor, search_questions
 from api.utils.validate import verify_query_id
-from flask import Response, g, jsonify, request
+from flask import (
+    Response,
+    current_app,
+    g,
+    jsonify,
+    request,
+    stream_with_context,
+)
+from api import page_cache
 from api.channel import channels
-from api.utils.wraps import login_required
-from db.docs import Queries, Users
+from api.utils.conditional import make_etag, not_modified, with_validators
+from api.utils.events import EVENT_ID, event_broker
+from api.utils.wraps import login_required, parse_pagination_params
+from db.docs import ChannelStats, Queries, Users, author_summaries
 from flasgger import swag_from
 
 res = {
@@ -17,6 +30,145 @@ res = {
 res_err = {"status": "error", "message": ""}
 
 
+@channels.route("/stats", strict_slashes=False)
+@login_required
+@swag_from("../../YAML/channels/get_stats.yml")
+def get_channel_stats() -> Response:
+    """
+    Return: a JSON representation of the statistics (questions,
+        responses, unanswered questions and last activity) of every
+        channel, or of the channel set as query parameter
+    """
+    channel = request.args.get("channel")
+
+    return jsonify({
+        "status": "success",
+        "message": "Channel statistics retrieved successfully",
+        "data": ChannelStats.get_stats(channel),
+    }), 200
+
+
+@channels.route("/<channel>/search", strict_slashes=False)
+@login_required
+@swag_from("../../YAML/channels/search.yml")
+def search_channel(channel: str) -> Response:
+    """
+    Args:
+        channel (str): channel to search in (all for every channel)
+    Return: a JSON representation of the questions matching the q query
+        parameter (title, text and responses), best matches first
+        (paginated with next_cursor)
+    """
+    text = request.args.get("q", "")
+    cursor = request.args.get("cursor")
+
+    try:
+        page_size = int(request.args.get("page_size") or 10)
+    except ValueError:
+        res_err["message"] = "page_size must be numerals"
+        return jsonify(res_err), 400
+
+    if page_size < 1:
+        res_err["message"] = "page_size must be at least 1"
+        return jsonify(res_err), 400
+    page_size = min(page_size, current_app.config["PAGE_SIZE_MAX"])
+
+    if not text.strip():
+        res_err["message"] = "Missing search text (q)"
+        return jsonify(res_err), 400
+
+    if cursor:
+        try:
+            decode_search_cursor(cursor)
+        except ValueError:
+            res_err["message"] = "Invalid cursor"
+            return jsonify(res_err), 400
+
+    questions, paginations_data = search_questions(
+        text, channel, page_size, cursor)
+
+    return jsonify({
+        "status": "success",
+        "message": "Questions retrieved successfully",
+        "data": questions,
+        **paginations_data,
+    }), 200
+
+
+@channels.route("/<channel>/export", strict_slashes=False)
+@login_required
+@swag_from("../../YAML/channels/export.yml")
+def export_channel(channel: str) -> Response:
+    """
+    Args:
+        channel (str): channel to export
+    Return: every question of the channel with its responses, one JSON
+        document per line (NDJSON), streamed as they are read
+    Note: the since query parameter (ISO 8601) limits the export to
+        questions updated or responded to since then
+    """
+    since = request.args.get("since")
+
+    if since:
+        try:
+            since = datetime.fromisoformat(since)
+        except ValueError:
+            res_err["message"] = "Invalid since, expected ISO 8601"
+            return jsonify(res_err), 400
+
+    questions = Queries.export(
+        channel, since, current_app.config["EXPORT_BATCH_SIZE"])
+
+    return Response(
+        stream_with_context(json.dumps(_) + "\n" for _ in questions),
+        mimetype="application/x-ndjson",
+    )
+
+
+@channels.route("/<channel>/events", strict_slashes=False)
+@channels.route("/<channel>/questions/<question_id>/events",
+                strict_slashes=False)
+@login_required
+@swag_from("../../YAML/channels/events.yml")
+def channel_events(channel: str, question_id: str = None) -> Response:
+    """
+    Args:
+        channel (str): channel to follow
+        question_id (str): question to follow (all the channel if None)
+    Return: a stream of the new questions and responses of the channel
+        (Server-Sent Events), with a heartbeat comment every
+        EVENTS_HEARTBEAT seconds
+    Note: a client sending Last-Event-ID (header or last_event_id query
+        parameter) first gets the events it missed, or a reset event
+        when they are no longer kept
+    """
+    last_event_id = request.headers.get("Last-Event-ID") or \
+        request.args.get("last_event_id")
+
+    if last_event_id and not EVENT_ID.match(last_event_id):
+        res_err["message"] = "Invalid Last-Event-ID"
+        return jsonify(res_err), 400
+
+    if question_id:
+        if not verify_query_id(question_id):
+            res_err["message"] = "Invalid question Id"
+            return jsonify(res_err), 400
+        # events carry the lower case hex of the id
+        question_id = str(ObjectId(question_id))
+        if not Queries.find_version(channel, id=question_id):
+            res_err["message"] = "No question with that Id"
+            return jsonify(res_err), 400
+
+    messages = event_broker.stream(channel, last_event_id, question_id)
+
+    response = Response(messages, mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # proxies (nginx) must not buffer the stream
+    response.headers["X-Accel-Buffering"] = "no"
+
+    return response
+
+
 @channels.route("/<channel>/<username>/", strict_slashes=False)
 @login_required
 @swag_from("../../YAML/channels/get_users_channel.yml")
@@ -31,6 +183,16 @@ def get_users_channel_data(channel: str, username: str) -> Response:
         to with their responses
     """
     user = None
+    name = g.user.username if username == "me" else username.lower()
+
+    # any question or response of the channel changes its generation
+    version = page_cache.version(channel)
+    if version:
+        etag = make_etag(channel, version[0], name)
+        cached = not_modified(etag, version[1])
+        if cached:
+            return cached
+
     if username == "me":
         user = g.user
     else:
@@ -39,14 +201,17 @@ def get_users_channel_data(channel: str, username: str) -> Response:
     if not user:
         return jsonify({"status": "error", "message": "Invalid Username"}), 400
 
-    db_data = Queries.get_user_questions_and_responses(user._id, channel)
+    db_data = Queries.get_user_questions_and_responses(user.id, channel)
 
     res["data"] = {
         "user_questions": db_data[0],
         "responded_questions": db_data[1]
         }
 
-    return jsonify(res), 200
+    response = jsonify(res)
+    if version:
+        with_validators(response, etag, version[1])
+    return response, 200
 
 
 @channels.route("/<channel>/multi", strict_slashes=False)
@@ -64,21 +229,32 @@ def fetch_multi_users_channels_query_response(channel: str) -> Response:
     names = request.args.getlist("name")
     res["data"] = {}
 
-    for username in names:
-        if username.lower() != "me":
-            user = Users.find_user(username.lower())
-        else:
-            user = g.user
+    if len(names) > current_app.config["MULTI_USERS_MAX"]:
+        res_err["message"] = (
+            f"Too many names, at most {current_app.config['MULTI_USERS_MAX']}"
+        )
+        return jsonify(res_err), 400
+
+    usernames = {
+        username: g.user.username if username.lower() == "me"
+        else username.lower()
+        for username in names
+    }
+    users = Users.find_users(list(usernames.values()))
 
-        if not user:
+    for username in names:
+        if usernames[username] not in users:
             res_err["message"] = f"Invalid username {username}"
             return jsonify(res_err), 400
 
-        db_data = Queries.get_user_questions_and_responses(user._id, channel)
+    db_data = Queries.get_users_questions_and_responses(
+        [user.id for user in users.values()], channel)
 
+    for username in names:
+        user = users[usernames[username]]
         res["data"][username] = {
-            "user_questions": db_data[0],
-            "responded_questions": db_data[1],
+            "user_questions": db_data[str(user.id)][0],
+            "responded_questions": db_data[str(user.id)][1],
         }
     return jsonify(res), 200
 
@@ -115,15 +291,15 @@ def get_query_by_channel_uname_qtitle(
     if verify_query_id(question_title_or_id):
         q_id = question_title_or_id
         db_data = Queries.get_user_questions_and_responses(
-            user._id, channel, _id=q_id)
+            user.id, channel, _id=q_id)
 
         if len(db_data) == 0:  # incase the info was title and not id
             db_data = Queries.get_user_questions_and_responses(
-                user._id, channel, question_title=question_title
+                user.id, channel, question_title=question_title
             )
     else:
         db_data = Queries.get_user_questions_and_responses(
-            user._id, channel, question_title=question_title
+            user.id, channel, question_title=question_title
         )
 
     res["data"] = {
@@ -147,32 +323,70 @@ def get_question(channel, question_id_or_title) -> Response:
     Return: a JSON representation of the question with the specified
         ID and its responses, if it is associated with the channel
     """
-    query = None
     question_title = question_id_or_title.replace("_", " ")
+    q_id = None
 
     if verify_query_id(question_id_or_title):
         q_id = question_id_or_title
-        query = Queries.find_query_by_id(channel=channel, _id=q_id)
 
-        if len(query) == 0:  # incase the info was title and not id
-            query = Queries.find_query_by_title(
-                channel=channel, question_title=question_title
-            )
-    else:
-        query = Queries.find_query_by_title(
-            channel=channel, question_title=question_title
-        )
+    # incase the info was title and not id
+    version = Queries.find_version(channel, q_id, question_title)
 
-    if not query:
+    if not version:
         res["message"] = "Invalid channel, question title or id"
         return (
             jsonify(res),
             400,
         )
 
-    res["data"] = query.to_dict()
+    etag = make_etag(version["_id"], version.get("updated_at"),
+                     version.get("responses_count", 0))
+    last_modified = max(filter(None, [
+        version.get("updated_at"), version.get("last_response_at")]))
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
 
-    return jsonify(res), 200
+    query = Queries.find_query_by_id(version["_id"], channel=channel)
+    res["data"] = author_summaries.embed([query.to_dict()])[0]
+
+    return with_validators(jsonify(res), etag, last_modified), 200
+
+
+@channels.route("/<channel>/questions/<question_id>/responses",
+                strict_slashes=False)
+@parse_pagination_params
+@login_required
+@swag_from("../../YAML/channels/get_responses.yml")
+def get_question_responses(channel, question_id) -> Response:
+    """
+    Args:
+        channel (str): channel of the question
+        question_id: id of the question
+
+    Return: a JSON representation of a page of the responses to the
+        question (oldest first), responses have embedded info of the
+        responder
+    """
+    if not verify_query_id(question_id):
+        res_err["message"] = "Invalid question Id"
+        return jsonify(res_err), 400
+
+    db_data = Queries.get_responses(
+        question_id, channel, g.page, g.page_size)
+
+    if not db_data:
+        res_err["message"] = "No question with that Id"
+        return jsonify(res_err), 400
+
+    responses, paginations_data = db_data
+
+    return jsonify({
+        "status": "success",
+        "message": "Responses retrieved successfully",
+        "data": responses,
+        **paginations_data,
+    }), 200
 
 
 @channels.route("/channel/response/<response_id>", strict_slashes=False)
@@ -191,26 +405,11 @@ def get_response(response_id) -> Response:
     except errors.InvalidId:
         return jsonify(res_err), 400
 
-    query = Queries.object.filter(responses___id=id)
-    response = None
+    data = Queries.find_response(id)
 
-    for res in query.responses:
-        if res._id == id:
-            response = res
-            break
-
-    if not query:
+    if not data:
         return jsonify(res_err), 400
 
-    data = {
-        "question_id": query.id,
-        "question": query.query_text,
-        "response_id": str(id),
-        "response": response.content,
-        "responder": response.author,
-        "created_at": response.created_at,
-        "updated_at": response.updated_at,
-    }
     res_suc = {
         "status": "success",
         "message": "Responses retrieved successfully",
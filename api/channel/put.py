@@ -3,9 +3,12 @@
 Module for updating questions and Responses
 """
 from bson import ObjectId, errors
-from flask import g, request, Response, jsonify
+from flask import current_app, g, request, Response, jsonify
+from api import page_cache
 from api.channel import channels
-from api.utils.emailing import send_emails
+from api.utils.events import publish_event, question_event, response_event
+from api.utils.outbox import enqueue_emails
+from api.utils.search import index_response
 from api.utils.validate import verify_query_data_and_send_mail
 from api.utils.wraps import login_required
 from db.docs import Queries, Responses, Users
@@ -39,11 +42,14 @@ def update_question() -> Response:
         res_err["message"] = "Invalid query input"
         return jsonify(res_err), 400
 
+    query = verification[2]
+    publish_event(query.channel, "question", question_event(query),
+                  current_app.config["EVENTS_MAXLEN"])
+
     if len(verification[1]) == 0:
         res_suc["message"] = "Query posted successfully"
         return jsonify(res_suc), 200
     else:
-        query = verification[2]
         res_suc["message"] = "Query posted successfully"
         res_suc["data"] = {"id": query.id, "content": query.query_text}
         res_suc["more_info"] = verification[1]
@@ -80,27 +86,30 @@ def post_response(channel, question_id) -> Response:
         return jsonify(res_err), 400
 
     query_res = Responses(content=content, author=g.user)
-    query.update(push__responses=query_res)
-    query.save()
+    query.add_response(query_res)
+    index_response(query, content)
+    page_cache.invalidate(channel, "all")
+    publish_event(channel, "response", response_event(query, query_res),
+                  current_app.config["EVENTS_MAXLEN"])
 
-    questioner = Users.objects(_id=query.author)
+    questioner = query.author
 
     contexts = {
         "questioner": questioner.username,
         "channel": channel,
         "question": query.query_text,
         "response": content,
-        "response_id": query_res._id,
+        "response_id": str(query_res._id),
     }
 
     email_info = (contexts, questioner.email)
     subject = "Your ConsultHub Question Has a New Answer!"
 
-    send_emails(subject, "response", email_info)
+    enqueue_emails(subject, "response", [email_info])
 
     data = {
-        "question_id": query._id,
-        "response_id": query_res._id,
+        "question_id": str(query.id),
+        "response_id": str(query_res._id),
         "question": query.query_text,
         "response": content,
     }
@@ -0,0 +1,688 @@
+#!/usr/bin/env python3
+"""
+Module for the command line interface
+Usage: flask --app api.app <command>
+"""
+import click
+import json
+import os
+import random
+import time
+import uuid
+from bson import ObjectId
+from flask import current_app
+from flask.cli import with_appcontext
+from jinja2 import Environment, FileSystemLoader
+from mongoengine.base.datastructures import EmbeddedDocumentList
+from typing import Tuple
+from api.utils.emailing import (
+    render_email_html,
+    render_email_html_bulk,
+    templates_env,
+)
+from api.utils.compression import ENCODINGS
+from api.utils.digest import flush_digests
+from api.utils.importer import QuestionImporter, read_records
+from api.utils.provisioning import provision_users
+from api.utils.outbox import OutboxWorker, outbox_stats
+from api.utils.search import rebuild_index
+from api import subscribers
+from db.docs import (
+    ChannelStats,
+    Queries,
+    ResponseBuckets,
+    Responses,
+    Users,
+    author_summaries,
+)
+from db.serializers import STRFTIME
+
+
+@click.command("outbox-worker")
+@click.option("--concurrency", type=int, default=None,
+              help="number of emails sent in parallel")
+@click.option("--name", default=None,
+              help="worker name (unique per running worker)")
+@with_appcontext
+def outbox_worker(concurrency: int, name: str) -> None:
+    """
+    drains the email outbox
+    """
+    worker = OutboxWorker(
+        concurrency=concurrency or current_app.config["OUTBOX_CONCURRENCY"],
+        max_attempts=current_app.config["OUTBOX_MAX_ATTEMPTS"],
+        backoff=current_app.config["OUTBOX_BACKOFF"],
+        name=name,
+        report=click.echo,
+    )
+    click.echo(f"outbox worker {worker.name}: {outbox_stats()}")
+
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+
+
+@click.command("bench-email-render")
+@click.option("--recipients", type=int, default=1000,
+              help="number of recipients in the fan-out")
+def bench_email_render(recipients: int) -> None:
+    """
+    measures the per-recipient cost of rendering question emails
+    """
+    contexts = [
+        {
+            "channel": "Developer",
+            "query_title": "How to use Django?",
+            "query_text": "I am new to Django, any good tutorials?" * 20,
+            "query_id": "0ca920885239ee74f292e7d3",
+            "channel_user": f"subscriber{i}",
+        }
+        for i in range(recipients)
+    ]
+
+    def uncached() -> None:
+        for context in contexts:
+            env = Environment(loader=FileSystemLoader(
+                templates_env.loader.searchpath))
+            env.get_template("question.html").render(**context)
+
+    def cached() -> None:
+        for context in contexts:
+            render_email_html(context, "question.html")
+
+    def bulk() -> None:
+        render_email_html_bulk(contexts, "question.html")
+
+    for name, func in [("environment per email", uncached),
+                       ("cached environment", cached),
+                       ("bulk render", bulk)]:
+        start = time.perf_counter()
+        func()
+        per_recipient = (time.perf_counter() - start) / recipients * 1e6
+        click.echo(f"{name:>22}: {per_recipient:9.1f} us/recipient")
+
+
+@click.command("send-digests")
+@click.argument("window", type=click.Choice(["hourly", "daily"]))
+@with_appcontext
+def send_digests(window: str) -> None:
+    """
+    queues the digest emails of a window (run from cron every window)
+    """
+    queued = flush_digests(window, current_app.config["DIGEST_BATCH_SIZE"])
+    click.echo(f"{queued} {window} digests queued")
+
+
+def reflective_to_dict(document) -> dict:
+    """
+    former to_dict of the documents, the reference of bench-serializers
+    """
+    attrs = getattr(
+        document, f"_{document.__class__.__name__}__attributes", None)
+    if not attrs:
+        raise AttributeError("Child class must have attributes attribute")
+    obj_dict = {}
+
+    for key in attrs:
+        if type(key) is str:  # for Users and general Queries
+            value = getattr(document, key)
+
+            if key in ["updated_at", "created_at"]:
+                value = value.strftime(STRFTIME)
+
+            obj_dict.update({key: value})
+        elif type(key) is dict:
+            for k, v in key.items():
+                embedded = getattr(document, k)
+
+                # for queries responses
+                if type(embedded) is EmbeddedDocumentList:
+                    obj_dict[k] = []
+                    for res in embedded:
+                        responses = {}
+                        for _ in v:
+                            value = getattr(res, _)
+
+                            if _ in ["updated_at", "created_at"]:
+                                value = value.strftime(STRFTIME)
+
+                            responses.update({_: value})
+                        obj_dict[k].append(responses)
+                else:  # for notications
+                    obj_dict[k] = {}
+                    for _ in v:
+                        value = getattr(embedded, _)
+                        obj_dict[k].update({_: value})
+
+    return obj_dict
+
+
+@click.command("bench-serializers")
+@click.option("--docs", type=int, default=1000,
+              help="number of questions serialized")
+@click.option("--responses", type=int, default=10,
+              help="number of responses per question")
+def bench_serializers(docs: int, responses: int) -> None:
+    """
+    compares the reflective, compiled and raw question serializers
+    """
+    # an in-memory author, so the reflective path does not dereference
+    author = Users(id=ObjectId(), username="benchauthor", field="developer")
+    questions = [
+        Queries(
+            id=ObjectId(), title=f"How to use Django? ({i})",
+            query_text="I am new to Django, any good tutorials?",
+            channel="developer", author=author,
+            responses=[Responses(content="Check the docs", author=author)
+                       for _ in range(responses)],
+        )
+        for i in range(docs)
+    ]
+    sons = [question.to_mongo().to_dict() for question in questions]
+
+    def build_and_compile() -> None:
+        for son in sons:
+            Queries._from_son(son).to_dict()
+
+    benches = [
+        ("reflective", lambda: [reflective_to_dict(_) for _ in questions]),
+        ("compiled", lambda: [_.to_dict() for _ in questions]),
+        ("_from_son + compiled", build_and_compile),
+        ("raw (as_pymongo)", lambda: [Queries.to_dict_raw(_) for _ in sons]),
+    ]
+
+    for name, func in benches:
+        start = time.perf_counter()
+        func()
+        per_doc = (time.perf_counter() - start) / docs * 1e6
+        click.echo(f"{name:>22}: {per_doc:9.1f} us/question")
+
+
+def legacy_user_questions_and_responses(
+    user_id: ObjectId,
+    channel: str,
+    question_title: str = None,
+    _id: ObjectId = None,
+) -> Tuple[list, list]:
+    """
+    former Queries.get_user_questions_and_responses (two queries and
+    filtering of every response in Python), the reference of
+    bench-user-questions
+    """
+    if question_title:
+        question_title = question_title.lower()
+        user_questions = Queries.objects(
+            author=user_id, channel=channel, query_title=question_title
+        )
+        responded_questions = Queries.objects(
+            responses__author=user_id,
+            channel=channel,
+            query_title=question_title
+        )
+    elif _id:
+        user_questions = Queries.objects(
+            author=user_id, channel=channel, id=ObjectId(_id)
+        )
+        responded_questions = Queries.objects(
+            responses__author=user_id, channel=channel, id=ObjectId(_id)
+        )
+    else:
+        user_questions = Queries.objects(author=user_id, channel=channel)
+        responded_questions = Queries.objects(
+            responses__author=user_id, channel=channel
+        )
+
+    user_questions_with_responses = [_.to_dict() for _ in user_questions]
+
+    responded_questions_with_responses = []
+    for question in responded_questions:
+        responses = []
+        for response in question.responses:
+            # raw reference, reading response.author dereferences it
+            author = response._data.get("author")
+            if getattr(author, "id", author) == user_id:
+                responses.append({
+                    "response_id": str(response._id),
+                    "content": response.content,
+                    "author": str(user_id),
+                    "created_at": response.created_at.strftime(STRFTIME),
+                    "updated_at": response.updated_at.strftime(STRFTIME),
+                })
+
+        responded_questions_with_responses.append({
+            "question_id": str(question.id),
+            "title": question.title,
+            "query_text": question.query_text,
+            "responses": responses,
+            "created_at": question.created_at.strftime(STRFTIME),
+            "updated_at": question.updated_at.strftime(STRFTIME),
+        })
+
+    author_summaries.embed(
+        user_questions_with_responses + responded_questions_with_responses)
+
+    return (user_questions_with_responses,
+            responded_questions_with_responses)
+
+
+@click.command("bench-user-questions")
+@click.option("--questions", type=int, default=20,
+              help="number of questions in the bench channel")
+@click.option("--responses", type=int, default=300,
+              help="number of responses per question")
+@click.option("--runs", type=int, default=20,
+              help="number of timed calls of each implementation")
+@with_appcontext
+def bench_user_questions(questions: int, responses: int, runs: int) -> None:
+    """
+    compares get_user_questions_and_responses with its former two-query
+    version on long threads (and checks that both return the same data)
+    """
+    channel = f"bench-{uuid.uuid4().hex[:8]}"
+    users = [
+        Users(username=f"bench{uuid.uuid4().hex[:8]}", field=channel,
+              email=f"bench{i}{uuid.uuid4().hex[:8]}@gmail.com",
+              password="benchpassword")
+        for i in range(4)
+    ]
+    for user in users:
+        user.save()
+
+    try:
+        for i in range(questions):
+            Queries(
+                title=f"Bench question number {i}", query_text="bench " * 20,
+                channel=channel, author=users[i % 2],
+                responses=[Responses(content="bench response",
+                                     author=users[j % 4])
+                           for j in range(responses)],
+            ).save()
+
+        def normalized(data) -> list:
+            return [sorted(json.dumps(_, sort_keys=True) for _ in part)
+                    for part in data]
+
+        for user in users[:1]:
+            new = Queries.get_user_questions_and_responses(user.id, channel)
+            old = legacy_user_questions_and_responses(user.id, channel)
+            click.echo(f"same output: {normalized(new) == normalized(old)}")
+
+        implementations = [
+            ("two queries (legacy)", legacy_user_questions_and_responses),
+            ("aggregation", Queries.get_user_questions_and_responses),
+        ]
+        for name, func in implementations:
+            start = time.perf_counter()
+            for _ in range(runs):
+                func(users[0].id, channel)
+            per_call = (time.perf_counter() - start) / runs * 1e3
+            click.echo(f"{name:>22}: {per_call:9.2f} ms/call")
+    finally:
+        Queries.objects(channel=channel).delete()
+        for user in users:
+            user.delete()
+
+
+@click.command("migrate-responses")
+@click.option("--batch-size", type=int, default=100,
+              help="questions read per round trip")
+@with_appcontext
+def migrate_responses(batch_size: int) -> None:
+    """
+    moves embedded responses to buckets (RESPONSES_STORAGE=bucketed),
+    in embedded storage only responses_count and last_response_at are set
+    """
+    if Queries.responses_storage != "bucketed":
+        result = Queries._get_collection().update_many(
+            {"bucketed": {"$ne": True}},
+            [{"$set": {
+                "responses_count": {"$size": {"$ifNull": ["$responses", []]}},
+                "last_response_at": {"$max": "$responses.created_at"},
+            }}],
+        )
+        click.echo(f"{result.modified_count} questions updated")
+        return
+
+    moved, retried, skipped = 0, 0, 0
+    questions = Queries.objects(bucketed__ne=True).batch_size(batch_size)
+
+    for question in questions.no_cache():
+        if not question.move_responses_to_buckets():
+            # a response was added meanwhile (which moves the question)
+            question.reload()
+            retried += 1
+            if question.bucketed:
+                continue
+            if not question.move_responses_to_buckets():
+                # being moved, or by a mover that crashed less than
+                # MOVE_TIMEOUT ago
+                skipped += 1
+                click.echo(f"  question {question.id}: being moved")
+                continue
+        moved += 1
+
+    click.echo(f"{moved} questions moved to buckets, {retried} retried, "
+               f"{skipped} skipped (run again later)")
+
+
+@click.command("reconcile-stats")
+@click.option("--batch-size", type=int, default=50,
+              help="channels recounted per aggregation")
+@with_appcontext
+def reconcile_stats(batch_size: int) -> None:
+    """
+    recounts the channel statistics from the questions (fixes drift)
+    """
+    drifted = ChannelStats.reconcile(batch_size)
+    click.echo(f"{drifted} channels reconciled")
+
+
+@click.command("search-index")
+@click.option("--batch-size", type=int, default=200,
+              help="questions indexed per round trip")
+@with_appcontext
+def search_index(batch_size: int) -> None:
+    """
+    rebuilds the search index from the questions and their responses
+    """
+    indexed = rebuild_index(batch_size)
+    click.echo(f"{indexed} questions indexed")
+
+
+@click.command("rebuild-subscribers")
+@click.option("--batch-size", type=int, default=500,
+              help="users written per round trip")
+@with_appcontext
+def rebuild_subscribers(batch_size: int) -> None:
+    """
+    recreates the channel subscribers kept in redis from the users
+    """
+    users = Users.objects().only(
+        "username", "email", "field", "notifications"
+    ).as_pymongo().batch_size(batch_size)
+    count = subscribers.rebuild(users, batch_size)
+    click.echo(f"{count} users read, general channel: "
+               f"{subscribers.count('general')} subscribers")
+
+
+@click.command("bench-compression")
+@click.option("--questions", type=int, default=50,
+              help="number of questions of the channel page")
+@click.option("--responses", type=int, default=10,
+              help="number of responses per question")
+@click.option("--runs", type=int, default=20,
+              help="number of timed compressions of each payload")
+def bench_compression(questions: int, responses: int, runs: int) -> None:
+    """
+    measures the bandwidth saved and the cpu cost of compressing a
+    channel page and a multi users dump
+    """
+    words = list({
+        word.strip(".,").lower()
+        for word in (Queries.__doc__ + Users.__doc__ + Responses.__doc__
+                     + click.__doc__ + json.__doc__).split()
+    })
+    generator = random.Random(0)
+    authors = [
+        {"id": str(ObjectId()), "username": f"consultant{i}",
+         "field": "developer"}
+        for i in range(20)
+    ]
+
+    def text(length: int) -> str:
+        return " ".join(generator.choices(words, k=length))
+
+    def question(i: int) -> dict:
+        author = ObjectId(authors[i % len(authors)]["id"])
+        return Queries(
+            id=ObjectId(), title=text(6), query_text=text(60),
+            channel="developer", author=author,
+            responses=[
+                Responses(content=text(40),
+                          author=ObjectId(authors[j % len(authors)]["id"]))
+                for j in range(responses)
+            ],
+        ).to_dict()
+
+    def embedded(data: list) -> list:
+        summaries = {author["id"]: author for author in authors}
+        for item in data:
+            item["author"] = summaries[item["author"]]
+            for response in item["responses"]:
+                response["author"] = summaries[response["author"]]
+        return data
+
+    page = embedded([question(i) for i in range(questions)])
+    multi = {
+        author["username"]: {
+            "user_questions": embedded([question(i) for i in range(5)]),
+            "responded_questions": [],
+        }
+        for author in authors
+    }
+    payloads = {
+        "channel page": json.dumps({"status": "success", "data": page}),
+        "multi users": json.dumps({"status": "success", "data": multi}),
+    }
+
+    for name, payload in payloads.items():
+        data = payload.encode("utf-8")
+        click.echo(f"{name}: {len(data) / 1024:.1f} KiB")
+
+        for encoding, compress in ENCODINGS.items():
+            for level in (1, 6, 9):
+                start = time.perf_counter()
+                for _ in range(runs):
+                    size = len(compress(data, level))
+                per_call = (time.perf_counter() - start) / runs * 1e3
+                click.echo(
+                    f"  {encoding:>7} level {level}: {size / 1024:8.1f} KiB "
+                    f"({1 - size / len(data):6.1%} saved) "
+                    f"{per_call:7.2f} ms")
+
+
+@click.command("export-channel")
+@click.argument("channel")
+@click.option("--since", type=click.DateTime(), default=None,
+              help="only questions updated or responded to since then")
+@click.option("--output", type=click.File("w"), default="-",
+              help="file to write to (default: stdout)")
+@with_appcontext
+def export_channel(channel: str, since, output) -> None:
+    """
+    exports the questions of a channel with their responses as NDJSON
+    """
+    questions = Queries.export(
+        channel, since, current_app.config["EXPORT_BATCH_SIZE"])
+
+    for question in questions:
+        output.write(json.dumps(question) + "\n")
+
+
+@click.command("import-questions")
+@click.argument("source", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["ndjson", "csv"]),
+              default=None, help="format of SOURCE (default: extension)")
+@click.option("--batch-size", type=int, default=500,
+              help="records inserted per round trip")
+@click.option("--checkpoint", default=None,
+              help="progress file (default: SOURCE.checkpoint)")
+@click.option("--restart", is_flag=True,
+              help="ignore the checkpoint and start from the beginning")
+@click.option("--errors", type=click.File("w"), default=None,
+              help="file to write the invalid records to (NDJSON)")
+@with_appcontext
+def import_questions(source: str, fmt: str, batch_size: int,
+                     checkpoint: str, restart: bool, errors) -> None:
+    """
+    imports questions with their responses (no email is sent)
+    """
+    importer = QuestionImporter(source, fmt, batch_size, checkpoint)
+    start = time.perf_counter()
+    try:
+        counts = importer.run(restart, report=click.echo)
+    except ValueError as e:
+        raise click.ClickException(f"{e} (use --restart to ignore it)")
+    elapsed = time.perf_counter() - start
+
+    for error in importer.errors:
+        if errors:
+            errors.write(json.dumps(error) + "\n")
+        else:
+            click.echo(f"  record {error['record']}: {error['error']}")
+    click.echo(
+        f"{counts['imported']} imported, {counts['skipped']} already "
+        f"imported, {counts['failed']} failed in {elapsed:.1f} s")
+    if counts["skipped"]:
+        # the statistics of a batch cut by a crash may be missing
+        click.echo("records imported before were skipped, run "
+                   "reconcile-stats to recount their channels")
+
+
+@click.command("import-users")
+@click.argument("source", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["ndjson", "csv"]),
+              default=None, help="format of SOURCE (default: extension)")
+@click.option("--batch-size", type=int, default=1000,
+              help="users checked and inserted per round trip")
+@click.option("--workers", type=int, default=None,
+              help="processes hashing passwords (default: all cores)")
+@click.option("--errors", type=click.File("w"), default=None,
+              help="file to write the rejected rows to (NDJSON)")
+@with_appcontext
+def import_users(source: str, fmt: str, batch_size: int, workers: int,
+                 errors) -> None:
+    """
+    creates user accounts in bulk (validated like /register)
+    """
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    created, rejected, offset = 0, 0, 0
+    batch = []
+
+    def flush() -> None:
+        nonlocal created, rejected, offset
+        users, failed = provision_users(batch, workers)
+        created += len(users)
+        rejected += len(failed)
+        for error in failed:
+            error["row"] += offset
+            if errors:
+                errors.write(json.dumps(error) + "\n")
+            else:
+                click.echo(f"  row {error['row']} ({error['status']}): "
+                           f"{error['message']}")
+        offset += len(batch)
+        batch.clear()
+        elapsed = time.perf_counter() - start
+        click.echo(f"{offset} rows read, {created / elapsed:.0f} users/s")
+
+    for row in read_records(source, fmt, json_columns=("notifications",)):
+        batch.append(row)
+        if len(batch) == batch_size:
+            flush()
+    if batch:
+        flush()
+
+    click.echo(f"{created} users created, {rejected} rejected in "
+               f"{time.perf_counter() - start:.1f} s")
+
+
+def query_shapes() -> dict:
+    """
+    querysets with the filters/sorts used by the Users and Queries methods
+    """
+    user_id, query_id = ObjectId(), ObjectId()
+
+    return {
+        "find_user": Users.objects(username="username"),
+        "find_user_by_channel": Users.objects(
+            field="developer", notifications__own_channel=True),
+        "get_queries": Queries.objects(channel="developer").order_by(
+            "-created_at", "-id"),
+        "find_query_by_title": Queries.objects(
+            channel="developer", query_title="title"),
+        "find_query_by_id": Queries.objects(
+            channel="developer", id=query_id),
+        "user_questions": Queries.objects(
+            author=user_id, channel="developer"),
+        "user_questions_by_title": Queries.objects(
+            author=user_id, channel="developer", query_title="title"),
+        "responded_questions": Queries.objects(
+            responses__author=user_id, channel="developer"),
+        "get_response": Queries.objects(responses___id=query_id),
+        "get_bucketed_response": ResponseBuckets.objects(
+            responses___id=query_id),
+        "get_responses": ResponseBuckets.objects(
+            question=query_id, index__gte=0, index__lte=1),
+        "responded_buckets": ResponseBuckets.objects(
+            channel="developer", responses__author__in=[user_id]),
+    }
+
+
+def plan_summary(stage: dict) -> str:
+    """
+    compact form of a winning plan, e.g. FETCH <- IXSCAN(channel_1)
+    """
+    stages = []
+
+    while stage:
+        name = stage.get("stage", "?")
+        if "indexName" in stage:
+            name += f"({stage['indexName']})"
+        stages.append(name)
+        stage = stage.get("inputStage") or next(
+            iter(stage.get("inputStages", [])), None)
+
+    return " <- ".join(stages)
+
+
+@click.command("indexes")
+@click.option("--explain", is_flag=True,
+              help="print the query plan of every query shape")
+@with_appcontext
+def indexes(explain: bool) -> None:
+    """
+    creates (in the background) and verifies the declared indexes
+    """
+    for document in [Users, Queries, ResponseBuckets]:
+        document.ensure_indexes()
+
+        declared = {tuple(fields) for fields in document.list_indexes()}
+        existing = {
+            tuple(info["key"])
+            for info in document._get_collection().index_information(
+            ).values()
+        }
+        missing = declared - existing
+
+        click.echo(f"{document.__name__}: {len(declared)} declared, "
+                   f"{len(missing)} missing")
+        for fields in missing:
+            click.echo(f"  missing {fields}")
+
+    if not explain:
+        return
+
+    for name, queryset in query_shapes().items():
+        plan = queryset.explain()["queryPlanner"]["winningPlan"]
+        click.echo(f"{name:>24}: {plan_summary(plan)}")
+
+
+cli_commands = [
+    outbox_worker,
+    bench_email_render,
+    send_digests,
+    indexes,
+    bench_serializers,
+    bench_user_questions,
+    migrate_responses,
+    reconcile_stats,
+    search_index,
+    rebuild_subscribers,
+    bench_compression,
+    export_channel,
+    import_questions,
+    import_users,
+]
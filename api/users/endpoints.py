@@ -2,11 +2,18 @@
 """
 Module for user verifications
 """
-from flask import Blueprint, Response, jsonify, request, g
+import json
+from flask import Blueprint, Response, current_app, jsonify, request, g
+from api.utils.conditional import make_etag, not_modified, with_validators
+from api.utils.provisioning import provision_users
 from api.utils.validate import validate_notifications
-from api.utils.wraps import json_required, login_required
+from api.utils.wraps import (
+    admin_required,
+    cached_user,
+    json_required,
+    login_required,
+)
 from flasgger import swag_from
-
 from db.docs import Users
 
 
@@ -25,13 +32,19 @@ def get_user(username) -> Response:
     Args:
         username(str): username to use in fetching db
     """
-    if username == "me":
-        return jsonify(g.user.to_dict()), 200
-    user = Users.find_user(username)
+    user = g.user if username == "me" else cached_user(username)
 
     if not user:
         return jsonify({"status": "error", "message": "Invalid username"}), 400
-    return jsonify(user.to_dict()), 200
+
+    # users come from the user cache, the etag is a hash of the data
+    data = user.to_dict()
+    etag = make_etag(json.dumps(data, sort_keys=True))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    return with_validators(jsonify(data), etag), 200
 
 
 @users_endpoints.route("/", strict_slashes=False,
@@ -50,7 +63,8 @@ def handle_user() -> Response:
     Note: can only update field and notifications
         other updates (including unknown fields) are discarded
     """
-    user = user = g.user
+    # the cached user has no password, saving needs the whole document
+    user = Users.find_user(g.user.username)
 
     data = request.get_json()
     field = data.get("field")
@@ -80,3 +94,40 @@ def handle_user() -> Response:
     user.update_user(**update)
 
     return jsonify(user.to_dict()), 200
+
+
+@users_endpoints.route("/bulk", strict_slashes=False, methods=["POST"])
+@json_required
+@login_required
+@admin_required
+@swag_from("../../YAML/users/post_bulk.yml")
+def create_users() -> Response:
+    """
+    function to create several user accounts at once (admin only)
+    Note: every user is validated like /register, the accounts of the
+        valid rows are created even if other rows are rejected
+    """
+    users = request.get_json().get("users")
+
+    if not isinstance(users, list) or len(users) == 0:
+        return jsonify({"status": "error", "message": "No users"}), 400
+
+    if len(users) > current_app.config["BULK_USERS_MAX"]:
+        return jsonify({
+            "status": "error",
+            "message": f"At most {current_app.config['BULK_USERS_MAX']} "
+            "users per request",
+        }), 400
+
+    created, errors = provision_users(users)
+
+    code = 201
+    if not created:
+        conflicts = all(_["status"] == "conflict" for _ in errors)
+        code = 409 if conflicts else 400
+
+    return jsonify({
+        "status": "success" if created else "error",
+        "created": [{**_.to_dict(), "id": str(_.id)} for _ in created],
+        "errors": errors,
+    }), code
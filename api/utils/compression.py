@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+module for compressing responses (gzip / deflate)
+Note: registered as an after_request hook, the encoding is negotiated
+    from Accept-Encoding and only large enough bodies are compressed
+"""
+import gzip
+import zlib
+from flask import Response, current_app, request
+
+ENCODINGS = {
+    "gzip": lambda data, level: gzip.compress(data, level, mtime=0),
+    "deflate": lambda data, level: zlib.compress(data, level),
+}
+
+
+def negotiate_encoding() -> str | None:
+    """
+    best encoding accepted by the client (gzip on a tie), None if none
+    """
+    best, best_quality = None, 0
+
+    for encoding in ENCODINGS:
+        quality = request.accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+
+    return best
+
+
+def compress_response(response: Response) -> Response:
+    """
+    Compress the body of a response when the client accepts it
+    Args:
+        response (Response): response of the view
+    Return: the response, compressed or not
+    Note: 304s, streamed and already encoded responses, other types
+        than COMPRESS_MIMETYPES and bodies under COMPRESS_MIN_SIZE bytes
+        are left as they are
+    """
+    config = current_app.config
+
+    if (
+        not config["COMPRESS_ENABLED"]
+        or response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in config["COMPRESS_MIMETYPES"]
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < config["COMPRESS_MIN_SIZE"]:
+        return response
+
+    encoding = negotiate_encoding()
+    if not encoding:
+        return response
+
+    response.set_data(ENCODINGS[encoding](data, config["COMPRESS_LEVEL"]))
+    response.headers["Content-Encoding"] = encoding
+
+    # the compressed body is another representation of the same data
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
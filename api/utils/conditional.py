@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+module for conditional GET requests (ETag / Last-Modified)
+Note: views compute the version of the data first (generation counter,
+    updated_at...), a client holding that version gets a 304 before
+    the data is read and serialized
+"""
+import hashlib
+from datetime import datetime, timezone
+from flask import Response, request
+
+
+def make_etag(*parts) -> str:
+    """
+    strong etag of a version of some data
+    Args:
+        parts: values identifying the version (e.g. id and updated_at)
+    Return (str): etag (unquoted)
+    """
+    raw = "\x1f".join(str(part) for part in parts).encode("utf-8")
+
+    return hashlib.sha1(raw).hexdigest()[:20]
+
+
+def not_modified(etag: str,
+                 last_modified: datetime = None) -> Response | None:
+    """
+    304 response when the copy of the client is current
+    Args:
+        etag (str): etag of the current version
+        last_modified (datetime): time of the last change (utc)
+    Return: the 304 response, or None when the data has to be sent
+    Note: If-Modified-Since is only used without If-None-Match
+    """
+    last_modified = utc(last_modified)
+
+    if request.if_none_match:
+        # weak comparison, compressed responses carry weak etags
+        current = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified:
+        current = last_modified.replace(microsecond=0) <= \
+            request.if_modified_since
+    else:
+        current = False
+
+    if not current:
+        return None
+
+    return with_validators(Response(status=304), etag, last_modified)
+
+
+def with_validators(response: Response, etag: str,
+                    last_modified: datetime = None) -> Response:
+    """
+    sets the etag and last modified headers of a response
+    Return: the response
+    """
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = utc(last_modified)
+    # clients revalidate every time, responses depend on the api key
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+    return response
+
+
+def utc(value: datetime | None) -> datetime | None:
+    """
+    aware utc datetime of a naive utc datetime (as stored by mongo)
+    """
+    if value and not value.tzinfo:
+        return value.replace(tzinfo=timezone.utc)
+
+    return value
@@ -2,7 +2,7 @@
 """
 module for config object
 """
-from os import getenv
+from os import cpu_count, getenv
 
 
 class Config:
@@ -18,3 +18,31 @@ class Config:
         'port': int(getenv('MONGO_PORT', '27017')),
         "alias": "default"
     }
+    USER_CACHE_SIZE = int(getenv("USER_CACHE_SIZE", "1024"))
+    USER_CACHE_TTL = int(getenv("USER_CACHE_TTL", "30"))
+    BCRYPT_ROUNDS = int(getenv("BCRYPT_ROUNDS", "12"))
+    BCRYPT_WORKERS = int(getenv("BCRYPT_WORKERS", str(cpu_count() or 2)))
+    BCRYPT_QUEUE_DEPTH = int(getenv("BCRYPT_QUEUE_DEPTH", "16"))
+    BCRYPT_BULK_WORKERS = int(getenv("BCRYPT_BULK_WORKERS", "2"))
+    OUTBOX_CONCURRENCY = int(getenv("OUTBOX_CONCURRENCY", "4"))
+    OUTBOX_MAX_ATTEMPTS = int(getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+    OUTBOX_BACKOFF = int(getenv("OUTBOX_BACKOFF", "30"))
+    DIGEST_BATCH_SIZE = int(getenv("DIGEST_BATCH_SIZE", "500"))
+    FANOUT_BATCH_SIZE = int(getenv("FANOUT_BATCH_SIZE", "500"))
+    MULTI_USERS_MAX = int(getenv("MULTI_USERS_MAX", "20"))
+    PAGE_SIZE_MAX = int(getenv("PAGE_SIZE_MAX", "100"))
+    RESPONSES_STORAGE = getenv("RESPONSES_STORAGE", "embedded")
+    PAGE_CACHE_TTL = int(getenv("PAGE_CACHE_TTL", "60"))
+    PAGE_CACHE_LOCK_TIMEOUT = float(getenv("PAGE_CACHE_LOCK_TIMEOUT", "5"))
+    COMPRESS_ENABLED = getenv("COMPRESS_ENABLED", "True") == "True"
+    COMPRESS_MIN_SIZE = int(getenv("COMPRESS_MIN_SIZE", "1024"))
+    COMPRESS_LEVEL = int(getenv("COMPRESS_LEVEL", "6"))
+    COMPRESS_MIMETYPES = getenv(
+        "COMPRESS_MIMETYPES", "application/json,text/html").split(",")
+    EXPORT_BATCH_SIZE = int(getenv("EXPORT_BATCH_SIZE", "500"))
+    ADMIN_USERS = [
+        _ for _ in getenv("ADMIN_USERS", "").lower().split(",") if _]
+    BULK_USERS_MAX = int(getenv("BULK_USERS_MAX", "500"))
+    EVENTS_MAX_CONNECTIONS = int(getenv("EVENTS_MAX_CONNECTIONS", "100"))
+    EVENTS_HEARTBEAT = int(getenv("EVENTS_HEARTBEAT", "15"))
+    EVENTS_MAXLEN = int(getenv("EVENTS_MAXLEN", "1000"))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+module for notification digests (Uses Redis)
+Note: users with a digest mode get new questions collected in redis,
+    one email per user and window is queued by the send-digests command
+"""
+from bson import ObjectId, json_util
+from typing import Dict, List
+from api import cache
+from api.utils.outbox import enqueue_emails
+from db.docs import Users
+
+EVENTS = "digest:events:"
+PENDING = "digest:pending:"
+
+
+def queue_digest_events(users: List[Dict], event: Dict) -> int:
+    """
+    Collect a new-question event for the digests of users (one round trip)
+    Args:
+        users (list): channel subscribers (id and digest) with a digest mode
+        event (dict): compact description of the question
+    Return (int): number of users the event was collected for
+    """
+    if not users:
+        return 0
+
+    raw = json_util.dumps(event)
+    pipe = cache.pipeline(transaction=True)
+
+    for user in users:
+        pipe.rpush(f"{EVENTS}{user['id']}", raw)
+        pipe.sadd(f"{PENDING}{user['digest']}", user["id"])
+    pipe.execute()
+
+    return len(users)
+
+
+def flush_digests(window: str, batch_size: int = 500) -> int:
+    """
+    Queue one digest email per user waiting on the window
+    Args:
+        window (str): digest mode to flush (hourly or daily)
+        batch_size (int): users handled per round trip
+    Return (int): number of digests queued
+    """
+    client = cache.client
+    subject = f"Your ConsultHub {window.capitalize()} Digest"
+    queued = 0
+
+    while True:
+        user_ids = client.spop(f"{PENDING}{window}", batch_size)
+        if not user_ids:
+            return queued
+
+        # events are read and cleared together, later ones start a new
+        # digest (the user is added back to the pending set)
+        pipe = cache.pipeline(transaction=True)
+        for user_id in user_ids:
+            pipe.lrange(f"{EVENTS}{user_id}", 0, -1)
+            pipe.delete(f"{EVENTS}{user_id}")
+        results = pipe.execute()[::2]
+
+        users = Users.objects(id__in=[ObjectId(_) for _ in user_ids])
+        users = {str(user.id): user for user in users}
+
+        email_info = []
+        for user_id, events in zip(user_ids, results):
+            user = users.get(user_id)
+            if not user or not events:
+                continue
+            email_info.append(({
+                "channel_user": user.username,
+                "window": window.capitalize(),
+                "questions": [json_util.loads(_) for _ in events],
+            }, user.email))
+
+        queued += enqueue_emails(subject, "digest", email_info)
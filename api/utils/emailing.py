@@ -4,13 +4,35 @@ module for emailing
 """
 import yagmail
 import os
+import queue
+import re
+import threading
+import time
+import uuid
 from jinja2 import Environment, FileSystemLoader
-from typing import Dict
+from typing import Dict, List
 
 
 sender_email = os.getenv("MAIL_SENDER")
 sender_password = os.getenv("MAIL_PASSWORD")
 
+# smtp server, defaults to gmail (point to a local sink for testing)
+smtp_config = {
+    "host": os.getenv("MAIL_HOST", "smtp.gmail.com"),
+    "port": int(os.getenv("MAIL_PORT", "465")),
+    "smtp_ssl": os.getenv("MAIL_SSL", "True") == "True",
+    "smtp_starttls": os.getenv("MAIL_STARTTLS", "False") == "True",
+    "smtp_skip_login": os.getenv("MAIL_SKIP_LOGIN", "False") == "True",
+}
+
+
+# templates are compiled once per process and kept by the environment
+templates_env = Environment(
+    loader=FileSystemLoader(
+        os.path.join(os.path.dirname(__file__), "templates")),
+    auto_reload=False,
+)
+
 
 def render_email_html(contexts: Dict, file: str) -> str:
     """
@@ -21,11 +43,7 @@ def render_email_html(contexts: Dict, file: str) -> str:
             assumes file is located in the templates dir
     return (str): complete html body, reay for sending
     """
-    # Create a Jinja environment
-    env = Environment(loader=FileSystemLoader("./api/utils/templates"))
-
-    # HTML template
-    template = env.get_template("response.html")
+    template = templates_env.get_template(file)
 
     # Render the template with the context variables
     output = template.render(**contexts)
@@ -33,29 +51,168 @@ def render_email_html(contexts: Dict, file: str) -> str:
     return output
 
 
-def send_emails(subject, body_type, email_info) -> None:
+def render_email_html_bulk(contexts: List[Dict], file: str) -> List[str]:
     """
-    Send emails using yagmail.
+    a function to render html bodies for many recipients at once
+    Args:
+        contexts (list): template variables of each recipient
+        file (str): name of file to read from
+            assumes file is located in the templates dir
+    return (list): complete html bodies, in the order of contexts
+    Note: variables equal for every recipient are rendered once, the
+        others (e.g. channel_user) are filled into the rendered output,
+        so they must be printed as is (no filters) in the template
+    """
+    if len(contexts) < 2:
+        return [render_email_html(context, file) for context in contexts]
+
+    first = contexts[0]
+    varying = {
+        key for key in first
+        if any(context.get(key) != first[key] for context in contexts)
+    }
+    for context in contexts:
+        varying.update(context.keys() - first.keys())
 
-    Parameters:
-    - subject (str): Email subject.
-    - body_type (str): Html Email to be sent.
-    - email_info (list): List of tuples made of
-        contexts(template variables to replace)
-        and email (mail addresses to send the emails to.)
+    tag = uuid.uuid4().hex
+    markers = {key: f"\x00{tag}:{key}\x00" for key in varying}
+    shared = render_email_html({**first, **markers}, file)
+
+    # even items are shared text, odd items are variable names
+    parts = re.split(f"\x00{tag}:(.*?)\x00", shared)
+    names = parts[1::2]
+
+    bodies = []
+    for context in contexts:
+        body = parts[:]
+        body[1::2] = [str(context.get(name, "")) for name in names]
+        bodies.append("".join(body))
+
+    return bodies
+
+
+def smtp_connection() -> yagmail.SMTP:
+    """
+    creates an smtp session using the configured server
     """
-    yag = yagmail.SMTP(sender_email, sender_password)
+    return yagmail.SMTP(sender_email, sender_password, **smtp_config)
+
+
+class RateLimiter:
+    """
+    class spacing out operations to at most rate per second
+    Note: a rate of 0 disables the limit
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.__lock = threading.Lock()
+        self.__next = 0.0
+
+    def wait(self) -> None:
+        """
+        blocks until the caller is allowed to proceed
+        """
+        if not self.rate:
+            return
+
+        with self.__lock:
+            now = time.monotonic()
+            slot = max(now, self.__next)
+            self.__next = slot + 1 / self.rate
+
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class SMTPSender:
+    """
+    class for sending emails over a pool of reusable smtp sessions
+    Note: at most pool_size sessions are open at once, a session is
+        replaced after max_messages emails and all sessions share
+        one rate limit (messages per second). The threads of the outbox
+        worker send on it concurrently, each reporting its own recipient
+    """
+
+    def __init__(self, pool_size: int = 4, max_messages: int = 100,
+                 rate: float = 0) -> None:
+        self.max_messages = max_messages
+        self.limiter = RateLimiter(rate)
+        self.__slots = threading.BoundedSemaphore(pool_size)
+        self.__idle = queue.LifoQueue()
+        # building messages (premailer/cssutils) is not thread safe
+        self.__compose_lock = threading.Lock()
+        self.__composer = None
+
+    def send(self, subject: str, content: str, to_email: str) -> None:
+        """
+        Send an already rendered html email
+        Args:
+            subject (str): Email subject
+            content (str): html body
+            to_email (str): mail address of the recipient
+        Note: errors are raised to the caller
+        """
+        # yag.send() logs in again on every call, so the message is
+        # built with yagmail and sent on the pooled session directly
+        with self.__compose_lock:
+            if not self.__composer:
+                self.__composer = smtp_connection()
+            recipients, message = self.__composer.prepare_send(
+                to=to_email, subject=subject, contents=content
+            )
+
+        self.__slots.acquire()
+        yag, sent = None, 0
+
+        try:
+            try:
+                yag, sent = self.__idle.get_nowait()
+            except queue.Empty:
+                yag = smtp_connection()
+                yag.login()
+
+            self.limiter.wait()
+            yag.smtp.sendmail(yag.user, recipients, message)
+            sent += 1
+        except Exception:
+            # the session may be broken, never reuse it
+            self.__discard(yag)
+            yag = None
+            raise
+        finally:
+            if yag and sent < self.max_messages:
+                self.__idle.put((yag, sent))
+            elif yag:
+                self.__discard(yag)
+            self.__slots.release()
+
+    def close(self) -> None:
+        """
+        A method to close the idle smtp sessions
+        """
+        while True:
+            try:
+                yag, _ = self.__idle.get_nowait()
+            except queue.Empty:
+                break
+            self.__discard(yag)
 
-    try:
-        # Send emails to each recipient
-        for context, to_email in email_info:
-            # Send the email
-            content = render_email_html(context, f"{body_type}.html")
-            yag.send(to=to_email, subject=subject, contents=content)
+    @staticmethod
+    def __discard(yag: yagmail.SMTP) -> None:
+        """
+        closes a session, ignoring errors of an already broken one
+        """
+        if not yag:
+            return
+        try:
+            yag.close()
+        except Exception:
+            pass
 
-    except Exception as e:
-        print(f"Error sending email: {str(e)}")
 
-    finally:
-        # Close the SMTP connection
-        yag.close()
+# limits of a session and of the whole sender (messages per second)
+smtp_limits = {
+    "max_messages": int(os.getenv("MAIL_MAX_PER_CONNECTION", "100")),
+    "rate": float(os.getenv("MAIL_RATE_LIMIT", "0")),
+}
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+module for live channel events (Server-Sent Events, Uses Redis)
+Note: new questions and responses are appended to a bounded stream per
+    channel (so clients can resume from their Last-Event-ID) and
+    announced on pub/sub. Each worker process listens to pub/sub on a
+    single connection and wakes the event streams of the channel, which
+    then read the new entries from the channel stream
+"""
+import json
+import os
+import queue
+import re
+import threading
+import time
+import redis
+from datetime import datetime
+from typing import Dict, Iterator, List, Tuple
+from api import cache
+from db.docs import Queries, Responses
+
+STREAM = "events:"
+EVENT_ID = re.compile(r"^\d+-\d+$")
+
+
+def publish_event(channel: str, event: str, data: Dict,
+                  maxlen: int = 1000) -> str:
+    """
+    Append an event to the stream of a channel and announce it
+    Args:
+        channel (str): channel of the event
+        event (str): type of the event (question or response)
+        data (dict): compact description of the event
+        maxlen (int): events kept per channel (about)
+    Return (str): id of the event
+    """
+    client = cache.client
+    event_id = client.xadd(
+        f"{STREAM}{channel}",
+        {"event": event, "data": json.dumps(data)},
+        maxlen=maxlen, approximate=True,
+    )
+    client.publish(f"{STREAM}{channel}", event_id)
+
+    return event_id
+
+
+def question_event(query: Queries) -> Dict:
+    """
+    compact event of a new question
+    """
+    return {
+        "question_id": str(query.id),
+        "title": query.title,
+        "author": str(query.author.id),
+        "created_at": format_date(query.created_at),
+    }
+
+
+def response_event(query: Queries, response: Responses) -> Dict:
+    """
+    compact event of a new response
+    """
+    return {
+        "question_id": str(query.id),
+        "response_id": str(response._id),
+        "author": str(response.author.id),
+        "created_at": format_date(response.created_at),
+    }
+
+
+def format_date(value: datetime) -> str:
+    """
+    date of an event (like the dates of the API responses)
+    """
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def parse_event_id(event_id: str) -> Tuple[int, int]:
+    """
+    comparable form of a stream id
+    """
+    milliseconds, sequence = event_id.split("-")
+
+    return int(milliseconds), int(sequence)
+
+
+class ConnectionLimit(Exception):
+    """
+    raised when a worker serves as many event streams as allowed
+    """
+
+
+class EventBroker:
+    """
+    class dispatching pub/sub announcements to the event streams of a
+    worker process
+    Note: the listening thread (and its redis connection) is started
+        with the first stream of the process. Announcements missed
+        while reconnecting are caught up by the streams themselves, as
+        they also read the channel stream on every heartbeat
+    """
+
+    def __init__(self, max_connections: int = 100,
+                 heartbeat: int = 15) -> None:
+        self.__lock = threading.Lock()
+        self.__pid = None
+        self.__waiters = {}
+        self.configure(max_connections, heartbeat)
+
+    def configure(self, max_connections: int = None,
+                  heartbeat: int = None) -> None:
+        """
+        A method to set the limits of the broker
+        Args:
+            max_connections (int): event streams served per process
+            heartbeat (int): seconds between two heartbeats
+        """
+        if max_connections:
+            self.max_connections = max_connections
+            self.__slots = threading.BoundedSemaphore(max_connections)
+        if heartbeat:
+            self.heartbeat = heartbeat
+
+    def connections(self) -> int:
+        """
+        A method to count the streams served by this process
+        """
+        with self.__lock:
+            return sum(len(_) for _ in self.__waiters.values())
+
+    def stream(self, channel: str, last_event_id: str = None,
+               question_id: str = None) -> Iterator[str]:
+        """
+        A method to open an event stream (text/event-stream body)
+        Args:
+            channel (str): channel to follow
+            last_event_id (str): id of the last event received, events
+                after it are sent first
+            question_id (str): only send the events of this question
+        Return: generator of SSE messages
+        Note: raises ConnectionLimit when the process serves
+            max_connections streams already
+        """
+        if not self.__slots.acquire(blocking=False):
+            raise ConnectionLimit("Too many event streams")
+
+        try:
+            self.__start()
+        except Exception:
+            self.__slots.release()
+            raise
+
+        messages = self.__messages(channel, last_event_id, question_id)
+        # started, so that closing the response always frees the slot
+        next(messages)
+
+        return messages
+
+    def __messages(self, channel: str, last_event_id: str,
+                   question_id: str) -> Iterator[str]:
+        """
+        SSE messages of a stream (until the client goes away)
+        """
+        key = f"{STREAM}{channel}"
+        client = cache.client
+        waiter = queue.SimpleQueue()
+
+        try:
+            self.__register(channel, waiter)
+            yield ""
+            yield f"retry: {self.heartbeat * 1000}\n\n"
+
+            if last_event_id:
+                oldest = client.xrange(key, count=1)
+                # 0-0 asks for every event kept
+                if oldest and last_event_id != "0-0" and parse_event_id(
+                        oldest[0][0]) > parse_event_id(last_event_id):
+                    # events were trimmed, the client has to reload
+                    yield "event: reset\ndata: {}\n\n"
+            else:
+                latest = client.xrevrange(key, count=1)
+                last_event_id = latest[0][0] if latest else "0-0"
+
+            while True:
+                entries = client.xread({key: last_event_id}, count=100)
+                for event_id, fields in entries[0][1] if entries else []:
+                    last_event_id = event_id
+                    data = json.loads(fields["data"])
+                    if question_id and data["question_id"] != question_id:
+                        continue
+                    yield (f"id: {event_id}\nevent: {fields['event']}\n"
+                           f"data: {fields['data']}\n\n")
+                if entries and len(entries[0][1]) == 100:
+                    continue
+
+                try:
+                    waiter.get(timeout=self.heartbeat)
+                    # announcements of the same burst are read together
+                    while not waiter.empty():
+                        waiter.get_nowait()
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+        finally:
+            self.__unregister(channel, waiter)
+            self.__slots.release()
+
+    def __register(self, channel: str, waiter: queue.SimpleQueue) -> None:
+        """
+        wakes the waiter on every announcement of the channel
+        """
+        with self.__lock:
+            self.__waiters.setdefault(channel, []).append(waiter)
+
+    def __unregister(self, channel: str, waiter: queue.SimpleQueue) -> None:
+        """
+        stops waking the waiter
+        """
+        with self.__lock:
+            waiters = self.__waiters.get(channel, [])
+            if waiter in waiters:
+                waiters.remove(waiter)
+            if not waiters:
+                self.__waiters.pop(channel, None)
+
+    def __start(self) -> None:
+        """
+        starts the listening thread of the current process
+        """
+        pid = os.getpid()
+
+        if self.__pid != pid:
+            with self.__lock:
+                if self.__pid != pid:
+                    self.__waiters = {}
+                    threading.Thread(
+                        target=self.__listen, name="event-broker",
+                        daemon=True).start()
+                    self.__pid = pid
+
+    def __listen(self) -> None:
+        """
+        wakes the streams of the channels announced on pub/sub
+        """
+        while True:
+            try:
+                pubsub = cache.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(f"{STREAM}*")
+                while True:
+                    message = pubsub.get_message(timeout=1)
+                    if message:
+                        self.__wake([message["channel"][len(STREAM):]])
+            except redis.RedisError:
+                time.sleep(1)
+                # announcements may have been missed meanwhile
+                with self.__lock:
+                    channels = list(self.__waiters)
+                self.__wake(channels)
+
+    def __wake(self, channels: List[str]) -> None:
+        """
+        wakes the streams of channels
+        """
+        with self.__lock:
+            waiters = [
+                waiter for channel in channels
+                for waiter in self.__waiters.get(channel, [])
+            ]
+        for waiter in waiters:
+            waiter.put(True)
+
+
+event_broker = EventBroker()
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+module for importing questions and responses in bulk
+Note: records are validated with the rules of the API and written with
+    unordered insert_many batches, no email is sent. Ids derive from
+    the source and the position of each record, so a batch imported
+    again (after a crash) is skipped instead of duplicated. Response
+    buckets are written before their question and missing search terms
+    of skipped questions are added, channel statistics of a batch cut
+    by a crash are fixed by reconcile-stats
+"""
+import csv
+import hashlib
+import json
+import os
+import struct
+import time
+from bson import ObjectId
+from collections import Counter
+from datetime import datetime, timezone
+from pymongo.errors import BulkWriteError
+from typing import Dict, Iterator, List, Tuple
+from api import cache, page_cache
+from api.utils.search import add_terms, indexed, question_terms
+from api.utils.validate import validate_query_data, verify_query_id
+from db.docs import (
+    BUCKET_SIZE,
+    ChannelStats,
+    Queries,
+    ResponseBuckets,
+    Responses,
+    Users,
+)
+
+DUPLICATE_KEY = 11000
+# id timestamp of records without created_at (keeps their ids stable)
+UNDATED = datetime(2000, 1, 1)
+
+
+class InvalidRecord(Exception):
+    """
+    invalid record
+    """
+
+
+def read_records(path: str, fmt: str = None,
+                 json_columns: Tuple[str] = ("responses",)) -> Iterator[Dict]:
+    """
+    reads the records of an NDJSON or CSV file
+    Args:
+        path (str): file to read
+        fmt (str): ndjson or csv (default: from the file extension)
+        json_columns (tuple): csv columns holding JSON values
+    Return: generator of records (dicts, or an exception for lines that
+        cannot be parsed)
+    Note: csv columns of questions are title, query_text, channel,
+        author, created_at and responses (a JSON list)
+    """
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "ndjson")
+
+    with open(path, newline="" if fmt == "csv" else None,
+              encoding="utf-8") as source:
+        if fmt == "csv":
+            for row in csv.DictReader(source):
+                try:
+                    for column in json_columns:
+                        if row.get(column):
+                            row[column] = json.loads(row[column])
+                except ValueError as e:
+                    row = InvalidRecord(f"Invalid {column} column: {e}")
+                yield row
+            return
+
+        for line in source:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield InvalidRecord(f"Invalid JSON: {e}")
+
+
+class QuestionImporter:
+    """
+    class importing question records (with their responses)
+    Note: progress is saved to the checkpoint file after every batch,
+        an interrupted import continues from there
+    """
+
+    def __init__(self, path: str, fmt: str = None, batch_size: int = 500,
+                 checkpoint: str = None) -> None:
+        self.path = path
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint or f"{path}.checkpoint"
+        self.source = os.path.basename(path)
+        self.position = 0
+        self.__resumed_at = 0
+        self.counts = Counter()
+        self.errors = []
+
+    def run(self, restart: bool = False, report=print) -> Counter:
+        """
+        A method to import the records not imported yet
+        Args:
+            restart (bool): ignore the checkpoint
+            report (function): called with a progress line per batch
+        Return (Counter): imported, skipped (already there) and failed
+            records
+        Note: raises ValueError when the checkpoint is for another source
+        """
+        if not restart and os.path.exists(self.checkpoint):
+            with open(self.checkpoint) as checkpoint:
+                state = json.load(checkpoint)
+            if state.get("source") != self.source:
+                raise ValueError(
+                    f"Checkpoint {self.checkpoint} is for "
+                    f"{state.get('source')}, not {self.source}")
+            self.position = state["position"]
+            self.counts.update(state["counts"])
+
+        self.__resumed_at = self.position
+        start = time.perf_counter()
+        batch = []
+
+        for position, record in enumerate(read_records(self.path, self.fmt)):
+            if position < self.position:
+                continue
+            batch.append((position, record))
+            if len(batch) == self.batch_size:
+                self.__import_batch(batch, start, report)
+                batch = []
+        if batch:
+            self.__import_batch(batch, start, report)
+
+        return self.counts
+
+    def __import_batch(self, batch: List[Tuple[int, Dict]], start: float,
+                       report) -> None:
+        """
+        validates and inserts a batch, then saves the checkpoint
+        """
+        authors = self.__resolve_authors([record for _, record in batch])
+        questions = []
+
+        for position, record in batch:
+            try:
+                questions.append(
+                    (position, self.__build(position, record, authors)))
+            except InvalidRecord as e:
+                self.__fail(position, str(e))
+
+        inserted, skipped = self.__insert(questions)
+        self.__after_insert(inserted, skipped)
+
+        self.position = batch[-1][0] + 1
+        self.__save_checkpoint()
+
+        elapsed = time.perf_counter() - start
+        done = self.position - self.__resumed_at
+        report(f"{self.position} records read, {dict(self.counts)}, "
+               f"{done / elapsed if elapsed else 0:.0f} records/s")
+
+    def __resolve_authors(self, records: List) -> Dict[str, Users]:
+        """
+        users named by the records of a batch (by username or id)
+        """
+        names = set()
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            names.add(record.get("author"))
+            for response in record.get("responses") or []:
+                if isinstance(response, dict):
+                    names.add(response.get("author"))
+        names = {_ for _ in names if isinstance(_, str) and _}
+
+        authors = Users.find_users(list(names))
+        ids = [ObjectId(_) for _ in names - authors.keys()
+               if verify_query_id(_)]
+        if ids:
+            authors.update({str(_.id): _ for _ in Users.objects(id__in=ids)})
+
+        return authors
+
+    def __build(self, position: int, record: Dict,
+                authors: Dict[str, Users]) -> Queries:
+        """
+        question document of a valid record (raises InvalidRecord)
+        """
+        if isinstance(record, Exception):
+            raise InvalidRecord(str(record))
+        if not isinstance(record, dict):
+            raise InvalidRecord("Record must be an object")
+
+        title, query_text = record.get("title"), record.get("query_text")
+        if not isinstance(title, str) or not isinstance(query_text, str) \
+                or not validate_query_data(record):
+            raise InvalidRecord("Invalid query input")
+
+        channel = record.get("channel")
+        if not isinstance(channel, str) or not channel.isalpha():
+            raise InvalidRecord("Invalid channel")
+
+        author = authors.get(record.get("author"))
+        if not author:
+            raise InvalidRecord(f"Unknown author {record.get('author')}")
+
+        created_at = self.__date(record.get("created_at"))
+        _id = self.__record_id(
+            position, created_at if record.get("created_at") else UNDATED)
+        responses = []
+        for response in record.get("responses") or []:
+            if not isinstance(response, dict) or not isinstance(
+                    response.get("content"), str) or not response["content"]:
+                raise InvalidRecord("Invalid response content")
+            responder = authors.get(response.get("author"))
+            if not responder:
+                raise InvalidRecord(
+                    f"Unknown response author {response.get('author')}")
+            responded_at = self.__date(response.get("created_at"))
+            responses.append(Responses(
+                content=response["content"], author=responder,
+                created_at=responded_at, updated_at=responded_at,
+            ))
+
+        return Queries(
+            id=_id, title=title,
+            query_text=query_text, channel=channel.lower(), author=author,
+            created_at=created_at, updated_at=created_at,
+            responses=responses, responses_count=len(responses),
+            last_response_at=max(
+                (_.created_at for _ in responses), default=None),
+        )
+
+    def __insert(self, questions: List[Tuple[int, Queries]]
+                 ) -> Tuple[List[Queries], List[Queries]]:
+        """
+        inserts questions (unordered)
+        Return: A Tuple of the inserted questions and of the skipped ones
+            (already there, imported by an interrupted run)
+        """
+        if not questions:
+            return [], []
+
+        bucketed = Queries.responses_storage == "bucketed"
+        if bucketed:
+            questions = self.__insert_buckets(questions)
+
+        documents = []
+        for _, question in questions:
+            document = question.to_mongo()
+            if bucketed:
+                document["responses"] = []
+                document["bucketed"] = True
+            documents.append(document)
+
+        failed = {}
+        if documents:
+            try:
+                Queries._get_collection().insert_many(
+                    documents, ordered=False)
+            except BulkWriteError as e:
+                failed = {_["index"]: _ for _ in e.details["writeErrors"]}
+
+        inserted, skipped = [], []
+        for index, (position, question) in enumerate(questions):
+            error = failed.get(index)
+            if not error:
+                inserted.append(question)
+                self.counts["imported"] += 1
+            elif error["code"] == DUPLICATE_KEY:
+                skipped.append(question)
+                self.counts["skipped"] += 1
+            else:
+                self.__fail(position, error["errmsg"])
+
+        return inserted, skipped
+
+    def __insert_buckets(self, questions: List[Tuple[int, Queries]]
+                         ) -> List[Tuple[int, Queries]]:
+        """
+        inserts the response buckets of questions before the questions
+            (buckets already there are kept) and returns the questions
+            whose buckets are all stored
+        """
+        buckets, owners = [], []
+        for index, (_, question) in enumerate(questions):
+            for start in range(0, len(question.responses), BUCKET_SIZE):
+                chunk = question.responses[start:start + BUCKET_SIZE]
+                buckets.append(ResponseBuckets(
+                    question=question.id, channel=question.channel,
+                    index=start // BUCKET_SIZE, count=len(chunk),
+                    responses=chunk,
+                ).to_mongo())
+                owners.append(index)
+
+        failed = {}
+        if buckets:
+            try:
+                ResponseBuckets._get_collection().insert_many(
+                    buckets, ordered=False)
+            except BulkWriteError as e:
+                failed = {
+                    owners[_["index"]]: _ for _ in e.details["writeErrors"]
+                    if _["code"] != DUPLICATE_KEY
+                }
+
+        for index, error in failed.items():
+            self.__fail(questions[index][0], error["errmsg"])
+
+        return [_ for index, _ in enumerate(questions) if index not in failed]
+
+    def __after_insert(self, inserted: List[Queries],
+                       skipped: List[Queries]) -> None:
+        """
+        updates channel statistics, search index and cached pages of
+            the inserted questions (instead of emailing the channel)
+        Note: skipped questions missing from the search index are
+            indexed, their statistics can not be told apart (see
+            reconcile-stats)
+        """
+        known = indexed([(_.channel, str(_.id)) for _ in skipped]) \
+            if skipped else []
+        unindexed = [_ for _, found in zip(skipped, known) if not found]
+        if not inserted and not unindexed:
+            return
+
+        # a question is indexed at once, or not at all
+        pipe = cache.pipeline(transaction=True)
+        for question in inserted + unindexed:
+            add_terms(pipe, question.channel, str(question.id), question_terms(
+                question.title, question.query_text,
+                [_.content for _ in question.responses]))
+        pipe.execute()
+
+        channels = {}
+        for question in inserted:
+            channels.setdefault(question.channel, []).append(question)
+
+        for channel, imported in channels.items():
+            ChannelStats.objects(channel=channel).update_one(
+                upsert=True,
+                inc__questions=len(imported),
+                inc__responses=sum(_.responses_count for _ in imported),
+                inc__unanswered=sum(not _.responses for _ in imported),
+                max__last_activity_at=max(
+                    _.last_response_at or _.created_at for _ in imported),
+            )
+
+        page_cache.invalidate(
+            *channels, *{_.channel for _ in unindexed}, "all")
+
+    def __record_id(self, position: int, created_at: datetime) -> ObjectId:
+        """
+        id of a record: creation time and hash of source and position
+        """
+        digest = hashlib.sha1(
+            f"{self.source}:{position}".encode("utf-8")).digest()[:8]
+        # created_at is naive utc, timestamp() would read it as local time
+        timestamp = int(created_at.replace(
+            tzinfo=timezone.utc).timestamp()) & 0xFFFFFFFF
+
+        return ObjectId(struct.pack(">I", timestamp) + digest)
+
+    def __fail(self, position: int, error: str) -> None:
+        """
+        records an invalid record
+        """
+        self.counts["failed"] += 1
+        self.errors.append({"record": position + 1, "error": error})
+
+    def __save_checkpoint(self) -> None:
+        """
+        saves the progress (atomically replaces the checkpoint file)
+        """
+        temporary = f"{self.checkpoint}.tmp"
+        with open(temporary, "w") as checkpoint:
+            json.dump({"source": self.source, "position": self.position,
+                       "counts": dict(self.counts)}, checkpoint)
+        os.replace(temporary, self.checkpoint)
+
+    @staticmethod
+    def __date(value) -> datetime:
+        """
+        creation time of a record (now when not set)
+        """
+        if not value:
+            return datetime.utcnow()
+        try:
+            date = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise InvalidRecord(f"Invalid date {value}")
+        if date.tzinfo:
+            # stored as naive utc, like the dates set by the API
+            date = date.astimezone(timezone.utc).replace(tzinfo=None)
+
+        return date
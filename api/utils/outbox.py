@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+module for the email outbox (Uses Redis)
+Note: request handlers only enqueue emails, the outbox is drained
+    by a separate worker process (flask --app api.app outbox-worker)
+"""
+import redis
+import socket
+import threading
+import time
+import uuid
+from bson import json_util
+from typing import Dict, List, Tuple
+from api import cache
+from api.utils.emailing import (
+    SMTPSender,
+    render_email_html,
+    render_email_html_bulk,
+    smtp_limits,
+)
+
+PENDING = "outbox:pending"
+RETRY = "outbox:retry"
+DEAD = "outbox:dead"
+PROCESSING = "outbox:processing:"
+# seconds between two attempts to reach redis again (doubled up to 30)
+REDIS_BACKOFF = 1
+
+
+def enqueue_emails(subject: str, body_type: str,
+                   email_info: List[Tuple[Dict, str]],
+                   render: bool = False) -> int:
+    """
+    Queue emails for the outbox worker (one round trip)
+    Args:
+        subject (str): Email subject
+        body_type (str): name of the html template (without .html)
+        email_info (list): List of tuples made of
+            contexts(template variables to replace)
+            and email (mail addresses to send the emails to.)
+        render (bool): render the bodies of the batch now with
+            render_email_html_bulk (see its note on templates),
+            otherwise the worker renders every email
+    Return (int): number of queued emails
+    """
+    contexts = [context for context, _ in email_info]
+    if render:
+        bodies = [
+            {"content": content} for content in
+            render_email_html_bulk(contexts, f"{body_type}.html")
+        ]
+    else:
+        bodies = [{"context": context} for context in contexts]
+
+    jobs = [
+        json_util.dumps({
+            "id": uuid.uuid4().hex,
+            "subject": subject,
+            "body_type": body_type,
+            **body,
+            "to": to_email,
+            "attempts": 0,
+        })
+        for body, (_, to_email) in zip(bodies, email_info)
+    ]
+
+    if jobs:
+        cache.client.rpush(PENDING, *jobs)
+
+    return len(jobs)
+
+
+def outbox_stats() -> Dict[str, int]:
+    """
+    sizes of the outbox lists
+    """
+    pipe = cache.pipeline()
+    pipe.llen(PENDING)
+    pipe.zcard(RETRY)
+    pipe.llen(DEAD)
+    pending, retry, dead = pipe.execute()
+
+    return {"pending": pending, "retry": retry, "dead": dead}
+
+
+class OutboxWorker:
+    """
+    class for draining the outbox
+    Note: every thread moves the job it works on to its own processing
+        list, jobs left there by a crashed worker are requeued when a
+        worker with the same name starts again. Failed jobs are retried
+        with exponential backoff and end up in the dead-letter list
+        after max_attempts. Redis errors are reported and retried, the
+        threads keep running
+    """
+
+    def __init__(self, concurrency: int = 4, max_attempts: int = 5,
+                 backoff: int = 30, name: str = None,
+                 sender: SMTPSender = None, report=print) -> None:
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.name = name or socket.gethostname()
+        self.sender = sender or SMTPSender(
+            pool_size=concurrency, **smtp_limits)
+        self.report = report
+        self.__stop = threading.Event()
+
+    def run(self) -> None:
+        """
+        A method to drain the outbox until stop() is called
+        """
+        threads = [
+            threading.Thread(target=self.__drain, args=(slot,), daemon=True)
+            for slot in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while not self.__stop.is_set():
+                try:
+                    self.promote_retries()
+                except redis.RedisError as e:
+                    self.report(f"outbox retries: {e}")
+                self.__stop.wait(1)
+        finally:
+            self.stop()
+            for thread in threads:
+                thread.join()
+            self.sender.close()
+
+    def stop(self) -> None:
+        """
+        A method to stop the worker after in-flight emails are sent
+        """
+        self.__stop.set()
+
+    def promote_retries(self) -> int:
+        """
+        A method to move retries that are due back to the pending list
+        Return (int): number of promoted jobs
+        """
+        client = cache.client
+        due = client.zrangebyscore(RETRY, 0, time.time(), start=0, num=100)
+        promoted = 0
+
+        for raw in due:
+            # only the worker that removes the job requeues it
+            if client.zrem(RETRY, raw):
+                client.rpush(PENDING, raw)
+                promoted += 1
+
+        return promoted
+
+    def __drain(self, slot: int) -> None:
+        """
+        sends queued emails, one at a time, on pooled smtp sessions
+        """
+        client = cache.client
+        processing = f"{PROCESSING}{self.name}:{slot}"
+        recovered, delay = False, REDIS_BACKOFF
+
+        while not self.__stop.is_set():
+            try:
+                if not recovered:
+                    # jobs interrupted during a previous run of this slot
+                    # (or by a redis error, they may be sent twice)
+                    while client.lmove(processing, PENDING, "RIGHT", "LEFT"):
+                        pass
+                    recovered = True
+
+                raw = client.blmove(PENDING, processing, 1, "LEFT", "RIGHT")
+                if raw:
+                    self.__send(processing, raw)
+                delay = REDIS_BACKOFF
+            except redis.RedisError as e:
+                self.report(f"outbox slot {slot}: {e}, "
+                            f"retrying in {delay} s")
+                recovered = False
+                self.__stop.wait(delay)
+                delay = min(delay * 2, 30)
+
+    def __send(self, processing: str, raw: str) -> None:
+        """
+        sends a job taken from the pending list
+        """
+        job = json_util.loads(raw)
+        try:
+            content = job.get("content")
+            if content is None:
+                content = render_email_html(
+                    job["context"], f"{job['body_type']}.html")
+            self.sender.send(job["subject"], content, job["to"])
+        except Exception as e:
+            self.__fail(processing, raw, job, e)
+        else:
+            cache.client.lrem(processing, 1, raw)
+
+    def __fail(self, processing: str, raw: str, job: Dict,
+               error: Exception) -> None:
+        """
+        schedules a retry of the job or moves it to the dead-letter list
+        """
+        job["attempts"] += 1
+        job["error"] = str(error)
+
+        pipe = cache.pipeline(transaction=True)
+        pipe.lrem(processing, 1, raw)
+        if job["attempts"] >= self.max_attempts:
+            pipe.lpush(DEAD, json_util.dumps(job))
+        else:
+            delay = self.backoff * 2 ** (job["attempts"] - 1)
+            pipe.zadd(RETRY, {json_util.dumps(job): time.time() + delay})
+        pipe.execute()
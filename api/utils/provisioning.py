@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+module for creating user accounts in bulk
+Note: rows are validated with the rules of /register, uniqueness is
+    checked for the whole batch with one query per key and passwords
+    are hashed with hash_many before a single insert_many
+"""
+import redis
+from mongoengine import ValidationError
+from pymongo.errors import BulkWriteError
+from typing import Dict, List, Tuple
+from api import subscribers
+from api.utils.validate import (
+    validate_email,
+    validate_notifications,
+    validate_password,
+    validate_uname,
+)
+from db.docs import Users
+from db.hashing import password_hasher
+
+DUPLICATE_KEY = 11000
+REQUIRED = ["username", "email", "password", "field"]
+DEFAULT_NOTIFICATIONS = {"own_channel": True, "general_channel": False}
+
+
+def validate_user_row(row: Dict) -> str | None:
+    """
+    function to validate a user row like /register does
+    Args:
+        row (dict): username, email, password, field and notifications
+    Return: error message, None when valid
+    """
+    if isinstance(row, Exception):
+        # line of an import file that could not be parsed
+        return str(row)
+    if not isinstance(row, dict):
+        return "Row must be an object"
+
+    missing = [_ for _ in REQUIRED if not isinstance(row.get(_), str)]
+    if missing:
+        return f"Info required but missing: {', '.join(missing)}"
+
+    if (
+        not validate_uname(row["username"].lower())
+        or not validate_password(row["password"])
+        or not validate_email(row["email"].lower())
+    ):
+        return "Invalid username, password or email(only Gmail)"
+
+    if len(row["field"]) == 0:
+        return "Field cannot be empty"
+
+    notifications = row.get("notifications")
+    if notifications and not validate_notifications(notifications):
+        return "Invalid notifications"
+
+    return None
+
+
+def provision_users(rows: List[Dict],
+                    workers: int = None) -> Tuple[List[Users], List[Dict]]:
+    """
+    Create the accounts of a batch of rows
+    Args:
+        rows (list): user rows (as sent to /register)
+        workers (int): processes hashing the passwords (command line
+            only, default: the bulk threads of the process)
+    Return: A Tuple of the created users and the rejected rows
+        ({"row", "username", "status": invalid|conflict, "message"})
+    Note: a username or email used twice in the batch is only created
+        for its first row
+    """
+    errors = []
+    valid = []
+
+    def reject(index: int, status: str, message: str) -> None:
+        username = rows[index].get("username") \
+            if isinstance(rows[index], dict) else None
+        errors.append({"row": index + 1, "username": username,
+                       "status": status, "message": message})
+
+    for index, row in enumerate(rows):
+        error = validate_user_row(row)
+        if error:
+            reject(index, "invalid", error)
+        else:
+            valid.append((index, row))
+
+    usernames = [row["username"].lower() for _, row in valid]
+    emails = [row["email"].lower() for _, row in valid]
+    taken_usernames = set(Users.objects(
+        username__in=usernames).scalar("username"))
+    taken_emails = set(Users.objects(email__in=emails).scalar("email"))
+
+    accepted = []
+    for (index, row), username, email in zip(valid, usernames, emails):
+        if username in taken_usernames:
+            reject(index, "conflict", "Account with username already exists")
+        elif email in taken_emails:
+            reject(index, "conflict", "Account with email already exists")
+        else:
+            taken_usernames.add(username)
+            taken_emails.add(email)
+            accepted.append((index, row, username, email))
+
+    hashes = password_hasher.hash_many(
+        [row["password"] for _, row, _, _ in accepted], workers)
+    users = []
+    for (index, row, username, email), hashed in zip(accepted, hashes):
+        user = Users(
+            username=username, email=email, password=hashed,
+            field=row["field"],
+            notifications=row.get("notifications") or DEFAULT_NOTIFICATIONS,
+        )
+        try:
+            user.validate()
+        except ValidationError as e:
+            reject(index, "invalid", str(e))
+            continue
+        users.append((index, user))
+
+    documents = [user.to_mongo() for _, user in users]
+    failed = {}
+    if documents:
+        try:
+            Users._get_collection().insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            failed = {_["index"]: _ for _ in e.details["writeErrors"]}
+
+    created = []
+    for position, (index, user) in enumerate(users):
+        error = failed.get(position)
+        if not error:
+            user.id = documents[position]["_id"]
+            created.append(user)
+        elif error["code"] == DUPLICATE_KEY:
+            # created by someone else since the uniqueness check
+            reject(index, "conflict",
+                   "Account with username or email already exists")
+        else:
+            reject(index, "invalid", error["errmsg"])
+
+    # insert_many sends no post_save signal, redis errors are left to
+    # rebuild-subscribers like for /register
+    try:
+        subscribers.add_many([user.to_mongo() for user in created])
+    except redis.RedisError:
+        pass
+    errors.sort(key=lambda error: error["row"])
+
+    return created, errors
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+module for searching questions (Uses Redis)
+Note: an inverted index of the title, text and responses of every
+    question is kept per channel and updated by every new question and
+    response, results are ranked with BM25
+"""
+import base64
+import math
+import os
+import re
+from bson import ObjectId
+from collections import Counter
+from typing import Dict, List, Tuple
+from api import cache
+from db.docs import Queries, ResponseBuckets, author_summaries
+
+PREFIX = "search:"
+CHANNELS = "search:channels"
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# a term of the title counts as many occurrences
+TITLE_WEIGHT = 2
+# postings read per query term (highest frequencies first)
+MAX_POSTINGS = int(os.getenv("SEARCH_MAX_POSTINGS", "5000"))
+
+STOPWORDS = frozenset("""
+    a an and are as at be by can do for from how i if in is it me my no
+    not of on or so that the this to was we what when where which who
+    why will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    terms of a text (lower case words, without stopwords)
+    """
+    return [
+        term for term in re.findall(r"[a-z0-9]+", (text or "").lower())
+        if len(term) > 1 and term not in STOPWORDS
+    ]
+
+
+def question_terms(title: str, query_text: str,
+                   responses: List[str] = ()) -> Counter:
+    """
+    term frequencies of a question
+    Args:
+        title (str): title of the question
+        query_text (str): text of the question
+        responses (list): contents of its responses
+    Return (Counter): term to number of occurrences
+    """
+    terms = Counter(tokenize(query_text))
+    for content in responses:
+        terms.update(tokenize(content))
+    for term in tokenize(title):
+        terms[term] += TITLE_WEIGHT
+
+    return terms
+
+
+def add_terms(pipe, channel: str, question_id: str, terms: Counter) -> None:
+    """
+    adds the terms of a question to the index (on a pipeline)
+    Note: terms are added to the ones already indexed, so a new response
+        only indexes its own content
+    """
+    key = f"{PREFIX}{channel}:"
+    length = sum(terms.values())
+
+    for term, frequency in terms.items():
+        pipe.zincrby(f"{key}t:{term}", frequency, question_id)
+    pipe.hincrby(f"{key}len", question_id, length)
+    pipe.incrby(f"{key}total", length)
+    pipe.sadd(CHANNELS, channel)
+
+
+def indexed(questions: List[Tuple[str, str]]) -> List[bool]:
+    """
+    tells which questions are in the index already (one round trip)
+    Args:
+        questions (list): channel and id of every question
+    Return (list): True for every indexed question, in order
+    """
+    pipe = cache.pipeline()
+    for channel, question_id in questions:
+        pipe.hexists(f"{PREFIX}{channel}:len", question_id)
+
+    return pipe.execute()
+
+
+def index_question(query: Queries) -> None:
+    """
+    Index a new question (one round trip)
+    Args:
+        query (Queries): the saved question
+    """
+    pipe = cache.pipeline(transaction=True)
+    add_terms(pipe, query.channel, str(query.id),
+              question_terms(query.title, query.query_text))
+    pipe.execute()
+
+
+def index_response(query: Queries, content: str) -> None:
+    """
+    Index a new response of a question (one round trip)
+    Args:
+        query (Queries): question responded to
+        content (str): content of the response
+    """
+    pipe = cache.pipeline(transaction=True)
+    add_terms(pipe, query.channel, str(query.id), Counter(tokenize(content)))
+    pipe.execute()
+
+
+def rebuild_index(batch_size: int = 200) -> int:
+    """
+    Rebuild the index from the questions
+    Args:
+        batch_size (int): questions read and indexed per round trip
+    Return (int): number of indexed questions
+    Note: questions posted while rebuilding may be indexed twice or not
+        at all, rebuild when the API is quiet
+    """
+    client = cache.client
+    keys = list(client.scan_iter(f"{PREFIX}*", count=1000))
+    for start in range(0, len(keys), 1000):
+        client.delete(*keys[start:start + 1000])
+
+    questions = Queries.objects().only(
+        "title", "query_text", "channel", "responses", "bucketed"
+    ).order_by("id").as_pymongo().batch_size(batch_size)
+    indexed = 0
+    batch = []
+
+    def flush() -> None:
+        bucketed = [_["_id"] for _ in batch if _.get("bucketed")]
+        contents = {}
+        for bucket in ResponseBuckets.objects(
+            question__in=bucketed
+        ).only("question", "responses.content").as_pymongo():
+            contents.setdefault(bucket["question"], []).extend(
+                _.get("content") for _ in bucket.get("responses", []))
+
+        pipe = cache.pipeline()
+        for question in batch:
+            responses = [_.get("content") for _ in question.get("responses")
+                         or []] + contents.get(question["_id"], [])
+            add_terms(pipe, question["channel"], str(question["_id"]),
+                      question_terms(question["title"],
+                                     question["query_text"], responses))
+        pipe.execute()
+        batch.clear()
+
+    for question in questions:
+        batch.append(question)
+        indexed += 1
+        if len(batch) == batch_size:
+            flush()
+    if batch:
+        flush()
+
+    return indexed
+
+
+def encode_search_cursor(score: float, question_id: str) -> str:
+    """
+    function to build the cursor of the result after the given one
+    """
+    token = f"{score!r}:{question_id}".encode("utf-8")
+
+    return base64.urlsafe_b64encode(token).decode("utf-8").rstrip("=")
+
+
+def decode_search_cursor(cursor: str) -> Tuple[float, str]:
+    """
+    function to read a search cursor
+    Note: raises ValueError for invalid cursors
+    """
+    try:
+        token = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        score, question_id = token.decode("utf-8").split(":")
+        return float(score), str(ObjectId(question_id))
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def score_channel(channel: str, terms: List[str]) -> Dict[str, float]:
+    """
+    BM25 scores of the questions of a channel matching any of the terms
+    """
+    key = f"{PREFIX}{channel}:"
+    pipe = cache.pipeline()
+    pipe.hlen(f"{key}len")
+    pipe.get(f"{key}total")
+    for term in terms:
+        pipe.zcard(f"{key}t:{term}")
+        pipe.zrevrange(f"{key}t:{term}", 0, MAX_POSTINGS - 1,
+                       withscores=True)
+    documents, total, *postings = pipe.execute()
+
+    if not documents:
+        return {}
+
+    average_length = int(total or 0) / documents or 1
+    matches = [
+        (math.log(1 + (documents - df + 0.5) / (df + 0.5)), hits)
+        for df, hits in zip(postings[::2], postings[1::2]) if hits
+    ]
+    question_ids = list({_id for _, hits in matches for _id, _ in hits})
+    if not question_ids:
+        return {}
+
+    lengths = dict(zip(question_ids, cache.client.hmget(
+        f"{key}len", question_ids)))
+    scores = {}
+
+    for idf, hits in matches:
+        for _id, frequency in hits:
+            norm = 1 - B + B * int(lengths[_id] or 0) / average_length
+            scores[_id] = scores.get(_id, 0) + idf * (
+                frequency * (K1 + 1) / (frequency + K1 * norm))
+
+    return scores
+
+
+def search_questions(
+    text: str, channel: str = "all", page_size: int = 10,
+    cursor: str = None,
+) -> Tuple[List[Dict], Dict[str, str]]:
+    """
+    Search questions, best matches first
+    Args:
+        text (str): words to search for
+        channel (str): channel to search in (all for every channel)
+        page_size (int): Number of items per page (default: 10).
+        cursor (str): next_cursor of a previous page
+    Return: A Tuple of list of questions (with their score, without
+        responses) and paginations data
+    """
+    terms = list(set(tokenize(text)))
+    channels = [channel]
+    if channel == "all":
+        channels = sorted(cache.client.smembers(CHANNELS))
+
+    scores = {}
+    for name in channels:
+        scores.update(score_channel(name, terms))
+
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    if cursor:
+        score, question_id = decode_search_cursor(cursor)
+        ranked = [
+            item for item in ranked
+            if (-item[1], item[0]) > (-score, question_id)
+        ]
+
+    page = ranked[:page_size]
+    pagination = {"next_cursor": None, "total": len(scores)}
+    if len(ranked) > page_size:
+        pagination["next_cursor"] = encode_search_cursor(*page[-1][::-1])
+
+    questions = {
+        str(question["_id"]): question
+        for question in Queries.objects(
+            id__in=[ObjectId(_id) for _id, _ in page]
+        ).exclude("responses").as_pymongo()
+    }
+    results = [
+        {
+            "question_id": _id,
+            "score": round(score, 4),
+            **Queries.to_dict_raw(questions[_id]),
+        }
+        for _id, score in page if _id in questions
+    ]
+
+    return author_summaries.embed(results), pagination
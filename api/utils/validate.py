@@ -3,9 +3,14 @@
 Module for utility functions
 """
 import re
-from typing import Dict, Tuple
-from db.docs import Queries, Users
-from api.utils.emailing import send_emails
+import redis
+from typing import Dict, Iterator, List, Tuple
+from flask import current_app
+from api import page_cache, subscribers
+from db.docs import DIGEST_MODES, ChannelStats, Queries, Users
+from api.utils.digest import queue_digest_events
+from api.utils.outbox import enqueue_emails
+from api.utils.search import index_question
 
 
 def validate_email(email: str) -> bool:
@@ -58,14 +63,17 @@ def validate_notifications(notification: Dict) -> bool:
         notification(str): data to verify
     Return(bool): if valid or not
     """
-    notifications_set = {"own_channel", "general_channel"}
+    notifications_set = {"own_channel", "general_channel", "digest"}
 
     try:
         for _ in notification.keys():
             if _ not in notifications_set:
                 return False
-        for _ in notification.values():
-            if type(_) is not bool:
+        for key, _ in notification.items():
+            if key == "digest":
+                if _ not in DIGEST_MODES:
+                    return False
+            elif type(_) is not bool:
                 return False
     except AttributeError:
         return False
@@ -96,6 +104,52 @@ def verify_query_id(id) -> bool:
     return False
 
 
+def validate_query_data(data: Dict) -> bool:
+    """
+    function to validate the title and text of a question
+    Args:
+        data (dict): query data
+    Return(bool): if valid or not
+    """
+    try:
+        return not (
+            len(data) == 0
+            or "title" not in data
+            or "query_text" not in data
+            or len(data["title"]) < 10
+            or len(data["query_text"]) < 10
+        )
+    except TypeError:
+        return False
+
+
+def read_subscribers(channel: str,
+                     batch_size: int) -> Tuple[int, Iterator[List[Dict]]]:
+    """
+    counts the subscribers of a channel and reads them in batches
+    Args:
+        channel (str): channel of the question
+        batch_size (int): subscribers per batch
+    Return: number of subscribers and generator of their batches
+    Note: redis drops empty hashes, so a channel without a hash has no
+        subscribers or lost them (flushed or evicted). Its users are
+        read from the database then, until rebuild-subscribers runs
+    """
+    try:
+        count = subscribers.count(channel)
+    except redis.RedisError:
+        count = 0
+    if count:
+        return count, subscribers.scan(channel, batch_size)
+
+    users = Users.find_user_by_channel(channel)
+    sons = users.only(
+        "username", "email", "notifications"
+    ).as_pymongo().batch_size(batch_size)
+
+    return users.count(), subscribers.from_users(sons, batch_size)
+
+
 def verify_query_data_and_send_mail(
     data: Dict, channel: str, questioner: Users
 ) -> bool | Tuple:
@@ -107,37 +161,22 @@ def verify_query_data_and_send_mail(
         channel (str): field to query users
         questioner (Users): current user
     """
-    def filter_by_uname(user) -> bool:
-        """
-        Args:
-            user: user to use data from filtering
-        """
-        return user.username != questioner.username
-
-    if (
-        len(data) == 0
-        or "title" not in data
-        or "query_text" not in data
-        or len(data["title"]) < 10
-        or len(data["query_text"]) < 10
-    ):
+    if not validate_query_data(data):
         return False
     title = data.get("title")
     query_text = data.get("query_text")
 
-    users = Users.find_user_by_channel(channel)
-
     more_info = ""
+    batch_size = current_app.config["FANOUT_BATCH_SIZE"]
     # assuming general channel will always be open (have users)
     # + assuming you are the only person in you channel
     # + the query will be generalized
-    if not users or len(users) == 1:
-        users = Users.find_user_by_channel("general")
+    users, batches = read_subscribers(channel, batch_size)
+    if users <= 1:
         channel = "general"
         more_info = "Your are the only user in the channel\
             thus you query as been generalized"
-
-    users = list(filter(filter_by_uname, users))
+        _, batches = read_subscribers(channel, batch_size)
 
     subject = "Exploring Together: Check Out the Latest Query"
     contexts = {
@@ -146,16 +185,37 @@ def verify_query_data_and_send_mail(
         "query_title": title.capitalize(),
     }
 
-    query = Queries(title=title, query_text=query_text, author=questioner)
+    query = Queries(
+        title=title, query_text=query_text, channel=channel, author=questioner
+    )
     query.save()
+    ChannelStats.record_question(channel, query.created_at)
+    index_question(query)
+    page_cache.invalidate(channel, "all")
+
+    event = {
+        "channel": contexts["channel"],
+        "query_id": str(query.id),
+        "query_title": contexts["query_title"],
+        "query_text": query_text[:280],
+    }
 
-    def generate_email_info(user_info: Users) -> Tuple:
-        contexts["channel_user"] = user_info.username
-        contexts["query_id"] = str(query._id)
-        return (contexts, user_info.email)
-
-    email_info = list(map(generate_email_info, users))
-
-    send_emails(subject, "question", email_info)
+    # subscribers are read in batches, users with a digest mode get the
+    # question in their next digest, the emails of a batch are rendered
+    # at once and queued with their bodies
+    for users in batches:
+        users = [_ for _ in users if _["username"] != questioner.username]
+
+        queue_digest_events([_ for _ in users if _["digest"] != "off"], event)
+
+        email_info = [
+            ({
+                **contexts,
+                "channel_user": user["username"],
+                "query_id": str(query.id),
+            }, user["email"])
+            for user in users if user["digest"] == "off"
+        ]
+        enqueue_emails(subject, "question", email_info, render=True)
 
     return True, more_info, query
@@ -3,15 +3,35 @@
 Module for Authentications
 """
 from functools import wraps
-from flask import g, jsonify, request, Response
+from flask import current_app, g, jsonify, request, Response
 from typing import Any, Callable
-from db.docs import Users
-from api import cache
+from db.docs import Users, decode_cursor
+from api import cache, user_cache
 
 
 err_res = {"status": "error", "message": ""}
 
 
+def cached_user(username: str) -> Users | None:
+    """
+    function to find a user through the user cache
+    Args:
+        username (str): username of the user
+    Return: the user, or None when there is no such user
+    Note: a cached user has no password, reload it (Users.find_user)
+        before saving it
+    """
+    son = user_cache.get(username)
+
+    if son:
+        return Users._from_son(son)
+
+    user = Users.find_user(username)
+    if user:
+        user_cache.set(username, user.to_mongo().to_dict())
+    return user
+
+
 def login_required(view_func) -> Callable[[str], Response]:
     """
     Custom decorator to check if the user is logged in
@@ -39,7 +59,7 @@ def login_required(view_func) -> Callable[[str], Response]:
             err_res["message"] = "Invalid Token"
             return jsonify(err_res), 401
 
-        g.user = Users.find_user(username)
+        g.user = cached_user(username)
         g.token = auth_token
 
         return view_func(*args, **kwargs)
@@ -47,6 +67,25 @@ def login_required(view_func) -> Callable[[str], Response]:
     return wrapper
 
 
+def admin_required(view_func) -> Callable[..., Response]:
+    """
+    Custom decorator restricting a view to the ADMIN_USERS
+    Note: goes after login_required, which sets g.user
+    """
+    @wraps(view_func)
+    def wrapper(*args, **kwargs) -> Any:
+        """
+        describe: function for authorizing the user
+        """
+        if g.user.username not in current_app.config["ADMIN_USERS"]:
+            err_res = {"status": "error", "message": "Admin only"}
+            return jsonify(err_res), 403
+
+        return view_func(*args, **kwargs)
+
+    return wrapper
+
+
 def json_required(func: Callable[..., Response]) -> Callable[..., Response]:
     """
     function to check whether the request contains JSON data
@@ -75,9 +114,10 @@ def parse_pagination_params(func) -> Callable[..., Response]:
     """
     @wraps(func)
     def wrapper(*args, **kwargs) -> Any:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         page = data.get("page") or request.args.get("page")
         page_size = data.get("page_size") or request.args.get("page_size")
+        cursor = data.get("cursor") or request.args.get("cursor")
 
         try:
             if page:
@@ -92,8 +132,21 @@ def parse_pagination_params(func) -> Callable[..., Response]:
             err_res["message"] = "page or page_size must be numerals"
             return jsonify(err_res), 400
 
+        if page_size < 1:
+            err_res["message"] = "page_size must be at least 1"
+            return jsonify(err_res), 400
+        page_size = min(page_size, current_app.config["PAGE_SIZE_MAX"])
+
+        if cursor:
+            try:
+                decode_cursor(cursor)
+            except ValueError:
+                err_res["message"] = "Invalid cursor"
+                return jsonify(err_res), 400
+
         g.page = page
         g.page_size = page_size
+        g.cursor = cursor
 
         return func(*args, **kwargs)
 
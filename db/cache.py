@@ -4,22 +4,63 @@ Module for Caching (Uses Redis)
 """
 import os
 import redis
+import threading
+import time
+import uuid
+from bson import json_util
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
 
 
 config_r = {
     "host": os.getenv("REDIS_HOST", "127.0.0.1"),
     "port": int(os.getenv("REDIS_PORT", "6379")),
     "decode_responses": True,
+    "max_connections": int(os.getenv("REDIS_MAX_CONNECTIONS", "20")),
+    "timeout": float(os.getenv("REDIS_POOL_TIMEOUT", "5")),
+    "socket_timeout": float(os.getenv("REDIS_SOCKET_TIMEOUT", "5")),
+    "socket_connect_timeout": float(
+        os.getenv("REDIS_CONNECT_TIMEOUT", "2")),
+    "health_check_interval": int(
+        os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30")),
 }
 
 
 class RedisConnect:
     """
     class for connecting to the redis database
+    Note: connections come from a bounded pool that is only created
+        on first use in the current process, so an instance made at
+        import time is safe to share with pre-forked workers
     """
 
-    def __init__(self) -> None:
-        self.__redis_instance = redis.StrictRedis(**config_r)
+    def __init__(self, **kwargs) -> None:
+        self.__options = {**config_r, **kwargs}
+        self.__lock = threading.Lock()
+        self.__pid = None
+        self.__pool = None
+        self.__redis_instance = None
+
+    @property
+    def client(self) -> redis.StrictRedis:
+        """
+        redis client bound to this process's connection pool
+        """
+        pid = os.getpid()
+
+        if self.__pid != pid:
+            with self.__lock:
+                if self.__pid != pid:
+                    # a pool inherited from the parent is dropped, not
+                    # closed, its sockets still belong to the parent
+                    self.__pool = redis.BlockingConnectionPool(
+                        **self.__options)
+                    self.__redis_instance = redis.StrictRedis(
+                        connection_pool=self.__pool)
+                    self.__pid = pid
+
+        return self.__redis_instance
 
     def get(self, key: str) -> str | None:
         """
@@ -31,14 +72,15 @@ class RedisConnect:
         if type(key) is not str:
             raise TypeError("RedisConnect search key must be a string")
 
-        return self.__redis_instance.get(key)
+        return self.client.get(key)
 
-    def set(self, key, value) -> bool:
+    def set(self, key, value, ttl: int = 3600 * 60 * 60) -> bool:
         """
         A method to set the key-value from database
         Args:
             key (str): key to set for
             value (str): value of key in redis
+            ttl (int): seconds before the key expires
         Return: True if key was set else false
         Note: Key or Value must be strings otherwise
             the process will raise an error
@@ -46,8 +88,7 @@ class RedisConnect:
         if type(key) is not str and type(value) is not str:
             raise TypeError("RedisConnect key and value must be strings")
 
-        ttl = 3600 * 60 * 60
-        return True if self.__redis_instance.setex(key, ttl, value) else False
+        return True if self.client.setex(key, ttl, value) else False
 
     def delete(self, key) -> bool:
         """
@@ -60,10 +101,619 @@ class RedisConnect:
         if type(key) is not str:
             raise TypeError("RedisConnect delete key must be a string")
 
-        return bool(self.__redis_instance.delete(key))
+        return bool(self.client.delete(key))
+
+    def pipeline(self, transaction: bool = False) -> redis.client.Pipeline:
+        """
+        A method to group several commands into one round trip
+        Args:
+            transaction (bool): wrap the commands in MULTI/EXEC
+        Return: pipeline, commands are sent on execute()
+        """
+        return self.client.pipeline(transaction=transaction)
+
+    def get_many(self, keys: List[str]) -> List[str | None]:
+        """
+        A method to retrive several keys in one round trip
+        Args:
+            keys (list): keys to search for
+        Return: values in the order of keys (None for missing keys)
+        """
+        if not keys:
+            return []
+
+        return self.client.mget(keys)
+
+    def set_many(self, mapping: Dict[str, str],
+                 ttl: int = 3600 * 60 * 60) -> bool:
+        """
+        A method to set several key-values in one round trip
+        Args:
+            mapping (dict): keys and their values
+            ttl (int): seconds before the keys expire
+        Return: True if all keys were set else false
+        """
+        if not mapping:
+            return True
+
+        pipe = self.pipeline()
+        for key, value in mapping.items():
+            pipe.setex(key, ttl, value)
+
+        return all(pipe.execute())
+
+    def delete_many(self, keys: List[str]) -> int:
+        """
+        A method to delete several keys in one round trip
+        Args:
+            keys (list): keys to delete
+        return: number of keys deleted
+        """
+        if not keys:
+            return 0
+
+        return self.client.delete(*keys)
+
+    def ping(self) -> bool:
+        """
+        A method to check the redis connection health
+        """
+        try:
+            return bool(self.client.ping())
+        except redis.RedisError:
+            return False
 
     def close(self) -> None:
         """
-        A method to close redis instance connection
+        A method to close the connections of this process's pool
+        Note: to be used on worker shutdown, not per request
+        """
+        with self.__lock:
+            if self.__pool and self.__pid == os.getpid():
+                self.__pool.disconnect()
+            self.__pid = None
+            self.__pool = None
+            self.__redis_instance = None
+
+
+class UserCache:
+    """
+    class for caching resolved users on the login_required path
+    Note: entries live in a small in-process LRU (with TTL) in front
+        of redis so that workers share users resolved by each other.
+        Users are stored as raw documents (SON) keyed by username,
+        without their password. Invalidations are broadcast on pub/sub,
+        a process only reads its LRU while it listens to them
+    """
+
+    prefix = "user:"
+    channel = "user:invalidate"
+
+    def __init__(self, redis_cache: RedisConnect,
+                 maxsize: int = 1024, ttl: int = 30) -> None:
+        self.__cache = redis_cache
+        self.__local = OrderedDict()
+        self.__lock = threading.Lock()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.__pid = None
+        self.__listening = threading.Event()
+
+    def get(self, username: str) -> Dict | None:
+        """
+        A method to retrive a cached user document
+        Args:
+            username (str): username of the user
+        Return: user document (dict) or None on a miss
         """
-        self.__redis_instance.close()
+        self.__start()
+        now = time.monotonic()
+
+        with self.__lock:
+            entry = self.__local.get(username)
+            if entry and entry[0] > now and self.__listening.is_set():
+                self.__local.move_to_end(username)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self.__local[username]
+
+        try:
+            raw = self.__cache.get(self.prefix + username)
+        except redis.RedisError:
+            raw = None
+
+        if not raw:
+            with self.__lock:
+                self.misses += 1
+            return None
+
+        son = json_util.loads(raw)
+        with self.__lock:
+            self.shared_hits += 1
+            self.__store(username, son, now)
+        return son
+
+    def set(self, username: str, son: Dict) -> None:
+        """
+        A method to cache a user document
+        Args:
+            username (str): username of the user
+            son (dict): raw user document (Users.to_mongo())
+        Note: the password is never cached
+        """
+        son = {key: son[key] for key in son if key != "password"}
+        with self.__lock:
+            self.__store(username, son, time.monotonic())
+
+        try:
+            self.__cache.set(
+                self.prefix + username, json_util.dumps(son), ttl=self.ttl
+            )
+        except redis.RedisError:
+            pass
+
+    def invalidate(self, username: str) -> None:
+        """
+        A method to drop a user from both cache layers (in every process)
+        Args:
+            username (str): username of the user
+        """
+        with self.__lock:
+            self.__local.pop(username, None)
+
+        try:
+            pipe = self.__cache.pipeline()
+            pipe.delete(self.prefix + username)
+            pipe.publish(self.channel, username)
+            pipe.execute()
+        except redis.RedisError:
+            pass
+
+    def stats(self) -> Dict:
+        """
+        A method to report cache hit/miss counters
+        """
+        with self.__lock:
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "size": len(self.__local),
+            }
+
+    def __store(self, username: str, son: Dict, now: float) -> None:
+        """
+        saves an entry in the local LRU (lock must be held)
+        """
+        self.__local[username] = (now + self.ttl, son)
+        self.__local.move_to_end(username)
+
+        while len(self.__local) > self.maxsize:
+            self.__local.popitem(last=False)
+
+    def __start(self) -> None:
+        """
+        starts the invalidation listener of the current process
+        """
+        pid = os.getpid()
+
+        if self.__pid != pid:
+            with self.__lock:
+                if self.__pid != pid:
+                    self.__local.clear()
+                    self.__listening = threading.Event()
+                    threading.Thread(
+                        target=self.__listen, args=(self.__listening,),
+                        name="user-cache", daemon=True).start()
+                    self.__pid = pid
+
+    def __listen(self, listening: threading.Event) -> None:
+        """
+        drops the users invalidated by any process from the local LRU
+        """
+        while True:
+            try:
+                pubsub = self.__cache.client.pubsub(
+                    ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                with self.__lock:
+                    self.__local.clear()
+                listening.set()
+                while True:
+                    message = pubsub.get_message(timeout=1)
+                    if message:
+                        with self.__lock:
+                            self.__local.pop(message["data"], None)
+            except redis.RedisError:
+                # invalidations may be missed until subscribed again
+                listening.clear()
+                with self.__lock:
+                    self.__local.clear()
+                time.sleep(1)
+
+
+class PageCache:
+    """
+    class for caching serialized pages (read-through)
+    Note: keys embed a generation counter per namespace (e.g. a channel),
+        writes bump the counter (invalidate) so pages cached before are
+        never read again and simply expire. On a miss a single process
+        recomputes the page while the others wait for it (single-flight)
+    """
+
+    prefix = "pages:"
+
+    def __init__(self, redis_cache: RedisConnect, ttl: int = 60,
+                 lock_timeout: float = 5) -> None:
+        self.__cache = redis_cache
+        self.__lock = threading.Lock()
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.hits = 0
+        self.waited_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get_or_compute(self, namespace: str, params: tuple,
+                       compute: Callable[[], Dict]) -> Dict:
+        """
+        A method to read a page from the cache, computing it on a miss
+        Args:
+            namespace (str): namespace of the page (invalidated together)
+            params (tuple): parameters identifying the page
+            compute (function): builds the page (json serializable dict)
+        Return: the page
+        Note: redis errors fall back to compute
+        """
+        try:
+            generation = self.__cache.get(f"{self.prefix}gen:{namespace}")
+            key = f"{self.prefix}{namespace}:{generation or 0}:" + ":".join(
+                "" if param is None else str(param) for param in params)
+            raw = self.__cache.get(key)
+        except redis.RedisError:
+            self.__count("errors")
+            return compute()
+
+        if raw:
+            self.__count("hits")
+            return json_util.loads(raw)
+
+        try:
+            return self.__fill(key, compute)
+        except redis.RedisError:
+            self.__count("errors")
+            return compute()
+
+    def invalidate(self, *namespaces: str) -> None:
+        """
+        A method to drop every cached page of namespaces (one round trip)
+        Args:
+            namespaces (str): namespaces to invalidate
+        """
+        pipe = self.__cache.pipeline()
+        now = int(time.time())
+        for namespace in namespaces:
+            pipe.set(f"{self.prefix}gen:{namespace}", self.__seed(), nx=True)
+            pipe.incr(f"{self.prefix}gen:{namespace}")
+            pipe.set(f"{self.prefix}mod:{namespace}", now)
+
+        try:
+            pipe.execute()
+        except redis.RedisError:
+            self.__count("errors")
+
+    def version(self, namespace: str) -> Tuple[int, datetime | None] | None:
+        """
+        A method to read the version of a namespace (one round trip)
+        Args:
+            namespace (str): namespace of the pages
+        Return: generation and time of the last invalidation (utc, None
+            when unknown), None when redis is unavailable or the
+            generation is missing
+        Note: a missing generation (flushed or evicted) could repeat one
+            already sent in an etag, so it is seeded again instead
+        """
+        generation_key = f"{self.prefix}gen:{namespace}"
+        try:
+            generation, modified = self.__cache.get_many([
+                generation_key, f"{self.prefix}mod:{namespace}",
+            ])
+            if generation is None:
+                self.__cache.client.set(
+                    generation_key, self.__seed(), nx=True)
+                return None
+        except redis.RedisError:
+            self.__count("errors")
+            return None
+
+        if modified:
+            modified = datetime.fromtimestamp(int(modified), timezone.utc)
+
+        return int(generation), modified
+
+    def stats(self) -> Dict:
+        """
+        A method to report cache hit/miss counters
+        """
+        with self.__lock:
+            hits = self.hits + self.waited_hits
+            total = hits + self.misses
+            return {
+                "hits": self.hits,
+                "waited_hits": self.waited_hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "hit_rate": round(hits / total, 4) if total else None,
+            }
+
+    def __fill(self, key: str, compute: Callable[[], Dict]) -> Dict:
+        """
+        computes and caches a missing page, or waits for the process
+        already computing it
+        """
+        client = self.__cache.client
+        lock = f"{self.prefix}lock:{key[len(self.prefix):]}"
+        token = uuid.uuid4().hex
+
+        if client.set(lock, token, nx=True, px=int(self.lock_timeout * 1e3)):
+            self.__count("misses")
+            try:
+                page = compute()
+                self.__cache.set(key, json_util.dumps(page), ttl=self.ttl)
+                return page
+            finally:
+                if client.get(lock) == token:
+                    client.delete(lock)
+
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.02)
+            raw = client.get(key)
+            if raw:
+                self.__count("waited_hits")
+                return json_util.loads(raw)
+            if not client.exists(lock):
+                break
+
+        # the computing process failed or is too slow
+        self.__count("misses")
+        return compute()
+
+    def __count(self, counter: str) -> None:
+        """
+        increments a counter
+        """
+        with self.__lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @staticmethod
+    def __seed() -> int:
+        """
+        first generation of a namespace (microseconds since the epoch),
+        so that it does not repeat a generation counted before
+        """
+        return time.time_ns() // 1000
+
+
+class ChannelSubscribers:
+    """
+    class keeping the subscribers of every channel in redis
+    Note: a hash per channel maps the id of each subscriber to what a
+        notification needs (username, email and digest mode), so posting
+        a question reads the subscribers in batches instead of querying
+        the users. Users of a field with own_channel notifications are
+        subscribed to that channel, users with general_channel ones to
+        the general channel. The channels of every user are kept too, to
+        unsubscribe them when their field or notifications change
+    """
+
+    prefix = "subscribers:"
+
+    def __init__(self, redis_cache: RedisConnect) -> None:
+        self.__cache = redis_cache
+
+    @staticmethod
+    def channels_of(son: Dict) -> List[str]:
+        """
+        channels a user is subscribed to
+        Args:
+            son (dict): raw user document (Users.to_mongo())
+        """
+        notifications = son.get("notifications") or {}
+        channels = []
+
+        if notifications.get("own_channel") and son.get("field"):
+            channels.append(son["field"])
+        if notifications.get("general_channel") and \
+                "general" not in channels:
+            channels.append("general")
+
+        return channels
+
+    @staticmethod
+    def entry(son: Dict) -> str:
+        """
+        value stored for a subscriber
+        """
+        notifications = son.get("notifications") or {}
+
+        return json_util.dumps({
+            "username": son["username"],
+            "email": son["email"],
+            "digest": notifications.get("digest") or "off",
+        })
+
+    def update(self, son: Dict) -> None:
+        """
+        A method to (re)subscribe a saved user to its channels
+        Args:
+            son (dict): raw user document (Users.to_mongo())
+        """
+        user_id = str(son["_id"])
+        key = f"{self.prefix}u:{user_id}"
+        channels = self.channels_of(son)
+        entry = self.entry(son)
+
+        def subscribe(pipe: redis.client.Pipeline) -> None:
+            previous = pipe.smembers(key)
+            pipe.multi()
+            for channel in previous - set(channels):
+                pipe.hdel(f"{self.prefix}c:{channel}", user_id)
+            self.__subscribe(pipe, user_id, channels, entry)
+
+        self.__cache.client.transaction(subscribe, key)
+
+    def add_many(self, sons: List[Dict]) -> None:
+        """
+        A method to subscribe new users (one round trip)
+        Args:
+            sons (list): raw documents of users not subscribed yet
+        """
+        pipe = self.__cache.pipeline(transaction=True)
+
+        for son in sons:
+            self.__subscribe(pipe, str(son["_id"]), self.channels_of(son),
+                             self.entry(son))
+        pipe.execute()
+
+    def remove(self, user_id: str) -> None:
+        """
+        A method to unsubscribe a deleted user
+        Args:
+            user_id (str): id of the user
+        """
+        key = f"{self.prefix}u:{user_id}"
+
+        def unsubscribe(pipe: redis.client.Pipeline) -> None:
+            channels = pipe.smembers(key)
+            pipe.multi()
+            for channel in channels:
+                pipe.hdel(f"{self.prefix}c:{channel}", user_id)
+            pipe.delete(key)
+
+        self.__cache.client.transaction(unsubscribe, key)
+
+    def count(self, channel: str) -> int:
+        """
+        A method to count the subscribers of a channel
+        """
+        return self.__cache.client.hlen(f"{self.prefix}c:{channel}")
+
+    @classmethod
+    def from_users(cls, sons: Iterable[Dict],
+                   batch_size: int = 500) -> Iterator[List[Dict]]:
+        """
+        A method to read subscribers from the users instead of redis
+        Args:
+            sons (iterable): raw documents of the subscribed users
+            batch_size (int): subscribers per batch
+        Return: generator of lists of subscribers, like scan
+        """
+        batch = []
+        for son in sons:
+            batch.append({"id": str(son["_id"]), **json_util.loads(
+                cls.entry(son))})
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def scan(self, channel: str,
+             batch_size: int = 500) -> Iterator[List[Dict]]:
+        """
+        A method to read the subscribers of a channel in batches
+        Args:
+            channel (str): channel to read
+            batch_size (int): subscribers read per round trip (about)
+        Return: generator of lists of subscribers (dicts with id,
+            username, email and digest)
+        Note: HSCAN may return an entry twice, those are skipped
+        """
+        client = self.__cache.client
+        key = f"{self.prefix}c:{channel}"
+        seen = set()
+        cursor = 0
+
+        while True:
+            cursor, entries = client.hscan(key, cursor, count=batch_size)
+            batch = [
+                {"id": user_id, **json_util.loads(raw)}
+                for user_id, raw in entries.items() if user_id not in seen
+            ]
+            seen.update(entries)
+            if batch:
+                yield batch
+            if not cursor:
+                return
+
+    def rebuild(self, sons: Iterable[Dict], batch_size: int = 500) -> int:
+        """
+        A method to recreate every subscriber hash from the users
+        Args:
+            sons (iterable): raw documents of all the users
+            batch_size (int): users written per round trip
+        Return (int): number of users read
+        Note: channels are built under temporary keys and swapped in at
+            the end, notifications read the previous hashes meanwhile.
+            Users saved while rebuilding may be missed, rebuild when
+            the API is quiet
+        """
+        client = self.__cache.client
+        building = f"{self.prefix}rebuild:{uuid.uuid4().hex}:"
+        channels, users = set(), set()
+        pipe = self.__cache.pipeline()
+
+        for count, son in enumerate(sons, 1):
+            user_id = str(son["_id"])
+            subscribed = self.channels_of(son)
+            entry = self.entry(son)
+            for channel in subscribed:
+                pipe.hset(f"{building}c:{channel}", user_id, entry)
+            pipe.delete(f"{self.prefix}u:{user_id}")
+            if subscribed:
+                pipe.sadd(f"{self.prefix}u:{user_id}", *subscribed)
+            channels.update(subscribed)
+            users.add(user_id)
+            if count % batch_size == 0:
+                pipe.execute()
+        pipe.execute()
+
+        previous = client.smembers(f"{self.prefix}channels")
+        pipe = self.__cache.pipeline(transaction=True)
+        for channel in channels:
+            pipe.rename(f"{building}c:{channel}", f"{self.prefix}c:{channel}")
+        for channel in previous - channels:
+            pipe.delete(f"{self.prefix}c:{channel}")
+        pipe.delete(f"{self.prefix}channels")
+        if channels:
+            pipe.sadd(f"{self.prefix}channels", *channels)
+        pipe.execute()
+
+        # users deleted without being unsubscribed
+        stale = [
+            key for key in client.scan_iter(f"{self.prefix}u:*", count=1000)
+            if key[len(self.prefix) + 2:] not in users
+        ]
+        for start in range(0, len(stale), 1000):
+            client.delete(*stale[start:start + 1000])
+
+        return len(users)
+
+    def __subscribe(self, pipe: redis.client.Pipeline, user_id: str,
+                    channels: List[str], entry: str) -> None:
+        """
+        adds a user to its channels (on a pipeline)
+        """
+        key = f"{self.prefix}u:{user_id}"
+
+        pipe.delete(key)
+        for channel in channels:
+            pipe.hset(f"{self.prefix}c:{channel}", user_id, entry)
+        if channels:
+            pipe.sadd(key, *channels)
+            pipe.sadd(f"{self.prefix}channels", *channels)
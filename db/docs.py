@@ -2,9 +2,15 @@
 """
 Module denoting the structure of mongoDB collections
 """
-import bcrypt
-from datetime import datetime
-from bson import ObjectId
+import base64
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from bson import ObjectId, errors
+from pymongo import ReturnDocument
+from db.hashing import password_hasher
+from db.serializers import STRFTIME, _fmt, _ref, compile_serializer
 
 from mongoengine import (
     BooleanField,
@@ -14,63 +20,85 @@ from mongoengine import (
     EmbeddedDocument,
     EmbeddedDocumentField,
     EmbeddedDocumentListField,
+    IntField,
+    NotUniqueError,
     ObjectIdField,
     ReferenceField,
     StringField,
     Q,
 )
-from mongoengine.base.datastructures import EmbeddedDocumentList
 
-from typing import Dict, List, Tuple
-STRFTIME = "%Y-%m-%d %H:%M:%S"
-
-
-class Base:
+from typing import Dict, Iterable, Iterator, List, Tuple
+# delivery of new-question emails (off: one email per question)
+DIGEST_MODES = ("off", "hourly", "daily")
+# where responses are kept (embedded in the question or in buckets)
+RESPONSES_STORAGE = ("embedded", "bucketed")
+# responses per bucket, fixed once buckets exist (positions depend on it)
+BUCKET_SIZE = 50
+# checks (and seconds between them) for a concurrent move to buckets
+MOVE_CHECKS, MOVE_WAIT = 40, 0.05
+# seconds after which the move of a question is taken over (crashed mover)
+MOVE_TIMEOUT = 60
+EPOCH = datetime(1970, 1, 1)
+
+
+def encode_cursor(created_at: datetime, _id: ObjectId, direction: str) -> str:
     """
-    Base class with common methods
+    function to build an opaque pagination cursor
+    Args:
+        created_at (datetime): created_at of the item at the page edge
+        _id (ObjectId): id of that item
+        direction (str): next or prev
+    Return (str): url safe token
     """
+    millis = (created_at - EPOCH) // timedelta(milliseconds=1)
+    token = f"{direction}:{millis}:{_id}".encode("utf-8")
 
-    def to_dict(self) -> Dict:
-        """
-        method that method to convert objects to dict
-        """
-        attrs = getattr(self, f"_{self.__class__.__name__}__attributes", None)
-        if not attrs:
-            raise AttributeError("Child class must have attributes attribute")
-        obj_dict = {}
+    return base64.urlsafe_b64encode(token).decode("utf-8").rstrip("=")
 
-        for key in attrs:
-            if type(key) is str:  # for Users and general Queries
-                value = getattr(self, key)
 
-                if key in ["updated_at", "created_at"]:
-                    value = value.strftime(STRFTIME)
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId, str]:
+    """
+    function to read a pagination cursor
+    Args:
+        cursor (str): token made by encode_cursor
+    Return: created_at, id and direction of the cursor
+    Note: raises ValueError for invalid cursors
+    """
+    try:
+        token = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        direction, millis, _id = token.decode("utf-8").split(":")
+        if direction not in ("next", "prev"):
+            raise ValueError("Invalid cursor direction")
+        created_at = EPOCH + timedelta(milliseconds=int(millis))
+        return created_at, ObjectId(_id), direction
+    except (UnicodeDecodeError, errors.InvalidId, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+class ResponsesMoving(Exception):
+    """
+    raised when a response waits too long for the responses of its
+    question to be moved to buckets
+    """
 
-                obj_dict.update({key: value})
-            elif type(key) is dict:
-                for k, v in key.items():
-                    embedded = getattr(self, k)
 
-                    # for queries responses
-                    if type(embedded) is EmbeddedDocumentList:
-                        obj_dict[k] = []
-                        for res in embedded:
-                            responses = {}
-                            for _ in v:
-                                value = getattr(res, _)
+class Base:
+    """
+    Base class with common methods
+    Note: to_dict (documents) and to_dict_raw (as_pymongo() dicts) are
+        generated for every child class from its __attributes
+    """
 
-                                if _ in ["updated_at", "created_at"]:
-                                    value = value.strftime(STRFTIME)
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
 
-                                responses.update({_: value})
-                            obj_dict[k].append(responses)
-                    else:  # for notications
-                        obj_dict[k] = {}
-                        for _ in v:
-                            value = getattr(embedded, _)
-                            obj_dict[k].update({_: value})
+        attrs = cls.__dict__.get(f"_{cls.__name__}__attributes")
+        if not attrs:
+            raise AttributeError("Child class must have attributes attribute")
 
-        return obj_dict
+        cls.to_dict = compile_serializer(cls, attrs)
+        cls.to_dict_raw = staticmethod(compile_serializer(cls, attrs, True))
 
 
 class Notifications(EmbeddedDocument):
@@ -80,6 +108,7 @@ class Notifications(EmbeddedDocument):
 
     own_channel = BooleanField(default=True)
     general_channel = BooleanField(default=False)
+    digest = StringField(choices=DIGEST_MODES, default="off")
 
 
 class Responses(EmbeddedDocument):
@@ -94,7 +123,7 @@ class Responses(EmbeddedDocument):
 
     _id = ObjectIdField(default=ObjectId)
     content = StringField(required=True)
-    author = ReferenceField("users", required=True)
+    author = ReferenceField("Users", required=True)
     created_at = DateTimeField(default=datetime.utcnow)
     updated_at = DateTimeField(default=datetime.utcnow)
 
@@ -113,11 +142,19 @@ class Users(Document, Base):
     field = StringField(required=True)
     notifications = EmbeddedDocumentField(Notifications)
 
+    meta = {
+        "index_background": True,
+        "indexes": [
+            # find_user_by_channel
+            "field",
+        ],
+    }
+
     __attributes = [
         "username",
         "email",
         "field",
-        {"notifications": ["own_channel", "general_channel"]},
+        {"notifications": ["own_channel", "general_channel", "digest"]},
     ]
 
     def __init__(self, **kwargs) -> None:
@@ -135,9 +172,7 @@ class Users(Document, Base):
         Arg:
             password (string): password to hash
         """
-        salt = bcrypt.gensalt()
-        hashed_passwd = bcrypt.hashpw(password.encode("utf-8"), salt)
-        self.password = hashed_passwd.decode("utf-8")
+        self.password = password_hasher.hash(password)
 
     def is_hashed(self, password) -> bool:
         """
@@ -157,7 +192,14 @@ class Users(Document, Base):
         """
         if not db_pwd:
             db_pwd = self.password
-        return bcrypt.checkpw(password.encode("utf-8"), db_pwd.encode("utf-8"))
+        return password_hasher.check(password, db_pwd)
+
+    def needs_rehash(self) -> bool:
+        """
+        method that checks if the stored hash uses an outdated work factor
+        Returns (bool): True if the password should be rehashed
+        """
+        return password_hasher.needs_rehash(self.password)
 
     @classmethod
     def find_user(cls, username) -> "Users":
@@ -171,6 +213,18 @@ class Users(Document, Base):
 
         return user
 
+    @classmethod
+    def find_users(cls, usernames: List[str]) -> Dict[str, "Users"]:
+        """
+        method that retrives several users by username (one query)
+        params:
+            usernames (list): usernames to use for filtering
+        Return: dict of username to User (unknown usernames are missing)
+        """
+        users = cls.objects(username__in=list(set(usernames)))
+
+        return {user.username: user for user in users}
+
     @classmethod
     def find_user_by_email(cls, email) -> "Users":
         """
@@ -186,23 +240,17 @@ class Users(Document, Base):
     @classmethod
     def find_user_by_channel(cls, channel: str) -> "Users":
         """
-        method that method to retrive user by channel
+        method that method to retrive the subscribers of a channel
         params:
             channel (str): channel/field to use for filtering
-        Return: First User or None
+        Return: QuerySet of the users notified of the channel
+        Note: questions are notified from the subscriber sets kept in
+            redis (ChannelSubscribers), which mirror this query
         """
-        user = None
-
         if channel == "general":
-            user = cls.objects().filter(
-                Q(notification__general_channel=True), field=channel
-            )
-        else:
-            user = cls.objects().filter(
-                Q(notification__own_channel=True), field=channel
-            )
+            return cls.objects(notifications__general_channel=True)
 
-        return user
+        return cls.objects(field=channel, notifications__own_channel=True)
 
     def update_user(self, **kwargs):
         """
@@ -223,6 +271,307 @@ class Users(Document, Base):
         self.save()
 
 
+class AuthorSummaries:
+    """
+    class resolving author ids to compact summaries in batches
+    Note: summaries are kept for a short while (ttl seconds) so that
+        consecutive pages mostly resolve from memory
+    """
+
+    def __init__(self, ttl: int = 60, maxsize: int = 10000) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.__lock = threading.Lock()
+        self.__summaries = {}
+
+    def resolve(self, ids: Iterable[str]) -> Dict[str, Dict]:
+        """
+        method that maps author ids to summaries (one $in query for misses)
+        params:
+            ids: author ids (str)
+        Return: dict of id to {"id", "username", "field"}
+        """
+        now = time.monotonic()
+        found, missing = {}, []
+
+        with self.__lock:
+            for _id in set(ids):
+                entry = self.__summaries.get(_id)
+                if entry and entry[0] > now:
+                    found[_id] = entry[1]
+                else:
+                    missing.append(_id)
+
+        if not missing:
+            return found
+
+        users = Users.objects(
+            id__in=[ObjectId(_id) for _id in missing]
+        ).only("username", "field").as_pymongo()
+
+        fetched = {
+            str(user["_id"]): {
+                "id": str(user["_id"]),
+                "username": user.get("username"),
+                "field": user.get("field"),
+            }
+            for user in users
+        }
+        for _id in missing:
+            # deleted authors keep their id only
+            fetched.setdefault(
+                _id, {"id": _id, "username": None, "field": None})
+
+        with self.__lock:
+            if len(self.__summaries) + len(fetched) > self.maxsize:
+                self.__summaries.clear()
+            for _id, summary in fetched.items():
+                self.__summaries[_id] = (now + self.ttl, summary)
+
+        return {**found, **fetched}
+
+    def embed(self, questions: List[Dict]) -> List[Dict]:
+        """
+        method that replaces the author ids of serialized questions and
+            their responses by author summaries (in place)
+        params:
+            questions (list): serialized questions
+        Return: the questions
+        """
+        ids = []
+        for question in questions:
+            if question.get("author"):
+                ids.append(question["author"])
+            for response in question.get("responses", []):
+                if response.get("author"):
+                    ids.append(response["author"])
+
+        if not ids:
+            return questions
+
+        summaries = self.resolve(ids)
+
+        for question in questions:
+            if question.get("author"):
+                question["author"] = summaries[question["author"]]
+            for response in question.get("responses", []):
+                if response.get("author"):
+                    response["author"] = summaries[response["author"]]
+
+        return questions
+
+
+author_summaries = AuthorSummaries()
+
+
+class ResponseBuckets(Document):
+    """
+    Represents the responses of a question in bucketed storage.
+    Attributes:
+    - question (ObjectIdField): id of the question.
+    - channel (StringField): channel of the question.
+    - index (IntField): position of the bucket, bucket i holds the
+        responses i * BUCKET_SIZE to (i + 1) * BUCKET_SIZE - 1.
+    - count (IntField): number of responses in the bucket.
+    - responses (ListField): responses of the bucket, oldest first.
+    - mover (StringField): token of the request moving the embedded
+        responses, unset once they are moved.
+    - moving_since (DateTimeField): start of that move.
+    """
+
+    question = ObjectIdField(required=True)
+    channel = StringField(required=True)
+    index = IntField(required=True)
+    count = IntField(default=0)
+    responses = EmbeddedDocumentListField(Responses)
+    mover = StringField()
+    moving_since = DateTimeField()
+
+    meta = {
+        "collection": "response_buckets",
+        "index_background": True,
+        "indexes": [
+            # get_responses, one bucket per position
+            {"fields": ("question", "index"), "unique": True},
+            # responded questions of bucketed storage
+            ("channel", "responses.author"),
+            # get_response
+            "responses._id",
+        ],
+    }
+
+    @classmethod
+    def get_range(cls, question_id: ObjectId, skip: int,
+                  limit: int) -> List[Dict]:
+        """
+        method that reads responses skip to skip + limit of a question
+        params:
+            question_id (ObjectId): id of the question
+            skip (int): position of the first response
+            limit (int): number of responses
+        Returns: raw responses, oldest first
+        Note: only the buckets covering the range are read
+        """
+        first = skip // BUCKET_SIZE
+        last = (skip + limit - 1) // BUCKET_SIZE
+
+        buckets = cls.objects(
+            question=question_id, index__gte=first, index__lte=last
+        ).order_by("index").only("responses").as_pymongo()
+
+        responses = [
+            response
+            for bucket in buckets
+            for response in bucket.get("responses", [])
+        ]
+        offset = skip - first * BUCKET_SIZE
+
+        return responses[offset:offset + limit]
+
+
+class ChannelStats(Document, Base):
+    """
+    Represents the statistics of a channel.
+    Attributes:
+    - channel (StringField): name of the channel (document id).
+    - questions (IntField): number of questions.
+    - responses (IntField): number of responses.
+    - unanswered (IntField): number of questions without responses.
+    - last_activity_at (DateTimeField): Date and time of the last
+        question or response.
+    - reconciled_at (DateTimeField): Date and time of the last recount.
+    Note: counters are incremented by every new question and response,
+        reconcile() recounts them from the questions to fix any drift
+    """
+
+    channel = StringField(primary_key=True)
+    questions = IntField(default=0)
+    responses = IntField(default=0)
+    unanswered = IntField(default=0)
+    last_activity_at = DateTimeField()
+    reconciled_at = DateTimeField()
+
+    meta = {"collection": "channel_stats"}
+
+    __attributes = [
+        "channel",
+        "questions",
+        "responses",
+        "unanswered",
+        "last_activity_at",
+    ]
+
+    @classmethod
+    def record_question(cls, channel: str, created_at: datetime) -> None:
+        """
+        method that counts a new question of a channel
+        params:
+            channel (str): channel of the question
+            created_at (datetime): creation time of the question
+        """
+        cls.objects(channel=channel).update_one(
+            upsert=True, inc__questions=1, inc__unanswered=1,
+            max__last_activity_at=created_at,
+        )
+
+    @classmethod
+    def record_response(cls, channel: str, created_at: datetime,
+                        first: bool) -> None:
+        """
+        method that counts a new response of a channel
+        params:
+            channel (str): channel of the question
+            created_at (datetime): creation time of the response
+            first (bool): first response to the question
+        """
+        cls.objects(channel=channel).update_one(
+            upsert=True, inc__responses=1,
+            inc__unanswered=-1 if first else 0,
+            max__last_activity_at=created_at,
+        )
+
+    @classmethod
+    def get_stats(cls, channel: str = None) -> List[Dict]:
+        """
+        method that retrieves the statistics of a channel (or all channels)
+        params:
+            channel (str): channel to focus on, all channels when not set
+        Returns: list of serialized statistics, ordered by channel
+        """
+        stats = cls.objects(channel=channel) if channel else cls.objects()
+
+        return [cls.to_dict_raw(_) for _ in stats.order_by("channel")
+                .as_pymongo()]
+
+    @classmethod
+    def reconcile(cls, batch_size: int = 50) -> int:
+        """
+        method that recounts the statistics of every channel from the
+            questions
+        params:
+            batch_size (int): channels recounted per aggregation
+        Returns: number of channels whose statistics drifted
+        Note: questions or responses posted while a batch is recounted
+            may be missed, they are counted again by the next run
+        """
+        channels = sorted(Queries.objects.distinct("channel"))
+        current = {_["_id"]: _ for _ in cls.objects().as_pymongo()}
+        drifted = 0
+
+        # responses of a question, embedded or in buckets
+        responses = {"$cond": [
+            {"$eq": ["$bucketed", True]},
+            {"$ifNull": ["$responses_count", 0]},
+            {"$size": {"$ifNull": ["$responses", []]}},
+        ]}
+
+        for start in range(0, len(channels), batch_size):
+            batch = channels[start:start + batch_size]
+            counts = Queries.objects(channel__in=batch).aggregate([
+                {"$project": {
+                    "channel": 1,
+                    "created_at": 1,
+                    "responses": responses,
+                    "last_response_at": {"$ifNull": [
+                        "$last_response_at", {"$max": "$responses.created_at"},
+                    ]},
+                }},
+                {"$group": {
+                    "_id": "$channel",
+                    "questions": {"$sum": 1},
+                    "responses": {"$sum": "$responses"},
+                    "unanswered": {"$sum": {
+                        "$cond": [{"$eq": ["$responses", 0]}, 1, 0]}},
+                    "last_question_at": {"$max": "$created_at"},
+                    "last_response_at": {"$max": "$last_response_at"},
+                }},
+            ])
+
+            for count in counts:
+                stats = {
+                    "questions": count["questions"],
+                    "responses": count["responses"],
+                    "unanswered": count["unanswered"],
+                    "last_activity_at": max(filter(None, [
+                        count["last_question_at"], count["last_response_at"],
+                    ]), default=None),
+                }
+                old = current.pop(count["_id"], {})
+                if any(old.get(key) != value for key, value in stats.items()):
+                    drifted += 1
+                    cls.objects(channel=count["_id"]).update_one(
+                        upsert=True, set__reconciled_at=datetime.utcnow(),
+                        **{f"set__{key}": value
+                           for key, value in stats.items()},
+                    )
+
+        # channels left without questions
+        if current:
+            drifted += cls.objects(channel__in=list(current)).delete()
+
+        return drifted
+
+
 class Queries(Document, Base):
     """
     Represents queries posted by users.
@@ -234,6 +583,10 @@ class Queries(Document, Base):
     - created_at (DateTimeField): Date and time of query creation.
     - responses (ListField): List of embedded documents for query responses.
         - EmbeddedDocumentField: Represents each response to the query.
+    - responses_count (IntField): number of responses.
+    - last_response_at (DateTimeField): Date and time of the last response.
+    - bucketed (BooleanField): responses are kept in ResponseBuckets
+        instead of responses.
     """
 
     title = StringField(required=True)
@@ -243,13 +596,42 @@ class Queries(Document, Base):
     created_at = DateTimeField(default=datetime.utcnow)
     updated_at = DateTimeField(default=datetime.utcnow)
     responses = EmbeddedDocumentListField(Responses)
+    responses_count = IntField(default=0)
+    last_response_at = DateTimeField()
+    bucketed = BooleanField(default=False)
+
+    # storage of new responses, set from the app config
+    responses_storage = "embedded"
+
+    meta = {
+        "index_background": True,
+        "indexes": [
+            # get_queries (newest first, _id breaks ties)
+            ("channel", "-created_at", "-_id"),
+            # find_query_by_title (with and without channel)
+            ("channel", "query_title"),
+            "query_title",
+            # get_user_questions_and_responses: authored questions
+            ("author", "channel", "query_title"),
+            # get_user_questions_and_responses: responded questions
+            ("responses.author", "channel", "query_title"),
+            # get_response
+            "responses._id",
+            # export (since)
+            ("channel", "updated_at"),
+            ("channel", "last_response_at"),
+        ],
+    }
 
     __attributes = [
         "title",
+        "author",
         "channel",
         "query_text",
         "created_at",
         "updated_at",
+        "responses_count",
+        "last_response_at",
         {"responses": ["content", "author", "created_at", "updated_at"]},
     ]
 
@@ -286,50 +668,420 @@ class Queries(Document, Base):
         Returns: class instance
         """
         if channel:
-            return cls.objects(channel=channel, _id=ObjectId(id)).first()
-        return cls.objects(_id=ObjectId(id)).first()
+            return cls.objects(channel=channel, id=ObjectId(id)).first()
+        return cls.objects(id=ObjectId(id)).first()
+
+    @classmethod
+    def find_version(cls, channel: str, id: ObjectId = None,
+                     title: str = None) -> Dict | None:
+        """
+        method that finds the version of a query based on id or title
+        params:
+            channel (str): channel to build upon
+            id (ObjectId): id to use for querying
+            title (str): title to use when there is no query with the id
+        Returns: raw document with only _id, updated_at, responses_count
+            and last_response_at
+        """
+        fields = ("id", "updated_at", "responses_count", "last_response_at")
+        version = None
+
+        if id:
+            version = cls.objects(channel=channel, id=ObjectId(id)).only(
+                *fields).as_pymongo().first()
+        if not version and title:
+            version = cls.objects(
+                channel=channel, query_title=title.lower()
+            ).only(*fields).as_pymongo().first()
+
+        return version
+
+    def add_response(self, response: Responses) -> None:
+        """
+        method that adds a response to the question
+        params:
+            response (Responses): the new response
+        Note: in bucketed storage the response goes to the bucket of its
+            position, embedded responses of the question are moved to
+            buckets first. The channel statistics are updated too
+        """
+        update = {
+            "$inc": {"responses_count": 1},
+            "$set": {"last_response_at": response.created_at},
+        }
+
+        if self.responses_storage != "bucketed":
+            update["$push"] = {"responses": response.to_mongo()}
+        else:
+            # counted once moved, the mover sets the count it moved
+            self.__wait_for_buckets()
+
+        # raw, the former count and first response are all that is read
+        before = self._get_collection().find_one_and_update(
+            {"_id": self.id}, update,
+            projection={"responses_count": 1, "responses": {"$slice": 1}},
+            return_document=ReturnDocument.BEFORE,
+        )
+        responses_count = before.get("responses_count", 0) + 1
+        # questions older than responses_count only have their responses
+        first = not before.get("responses_count") \
+            and not before.get("responses")
+
+        if self.responses_storage == "bucketed":
+            ResponseBuckets.objects(
+                question=self.id, index=(responses_count - 1) // BUCKET_SIZE
+            ).update_one(
+                upsert=True, push__responses=response, inc__count=1,
+                set_on_insert__channel=self.channel,
+            )
+
+        ChannelStats.record_response(
+            self.channel, response.created_at, first)
+
+    def __wait_for_buckets(self) -> None:
+        """
+        moves the embedded responses of the question to buckets, or
+            waits until the concurrent request moving them is done
+        Note: raises ResponsesMoving when the move takes too long
+        """
+        for _ in range(MOVE_CHECKS):
+            if self.bucketed or self.move_responses_to_buckets():
+                return
+            time.sleep(MOVE_WAIT)
+            self.reload()
+
+        raise ResponsesMoving("Responses of the question are being moved")
+
+    def move_responses_to_buckets(self) -> bool:
+        """
+        method that moves the embedded responses of the question to buckets
+        Returns: False when nothing was moved, i.e. the responses changed
+            meanwhile or the question is being moved by someone else
+        Note: a move older than MOVE_TIMEOUT (its mover crashed) is
+            cancelled and started again
+        """
+        responses = list(self.responses)
+        mover = uuid.uuid4().hex
+        buckets = [
+            ResponseBuckets(
+                question=self.id, channel=self.channel,
+                index=start // BUCKET_SIZE, count=len(chunk),
+                responses=chunk, mover=mover, moving_since=datetime.utcnow(),
+            )
+            for start in range(0, len(responses), BUCKET_SIZE)
+            for chunk in [responses[start:start + BUCKET_SIZE]]
+        ]
+
+        for attempt in range(2):
+            try:
+                # bucket 0 is unique, it locks the question for one mover
+                if buckets:
+                    ResponseBuckets.objects.insert(
+                        buckets[0], load_bulk=False)
+                break
+            except NotUniqueError:
+                if attempt or not self.__cancel_stale_move():
+                    return False
+        if buckets[1:]:
+            ResponseBuckets.objects.insert(buckets[1:], load_bulk=False)
+
+        last_response_at = max(
+            (response.created_at for response in responses), default=None)
+        moved = Queries.objects(
+            id=self.id, bucketed__ne=True,
+            __raw__={f"responses.{len(responses)}": {"$exists": False}},
+        ).update_one(
+            set__bucketed=True, set__responses=[],
+            set__responses_count=len(responses),
+            set__last_response_at=last_response_at,
+        )
+
+        if not moved:
+            ResponseBuckets.objects(question=self.id, mover=mover).delete()
+            return False
+
+        ResponseBuckets.objects(question=self.id, mover=mover).update(
+            unset__mover=True, unset__moving_since=True)
+        self.bucketed = True
+        self.responses = []
+        self.responses_count = len(responses)
+        self.last_response_at = last_response_at
+        return True
+
+    def __cancel_stale_move(self) -> bool:
+        """
+        deletes the buckets of a move that started more than MOVE_TIMEOUT
+        ago and did not complete
+        Returns: True when the question can be moved again
+        """
+        lock = ResponseBuckets.objects(question=self.id, index=0).only(
+            "mover", "moving_since").as_pymongo().first()
+        if not lock:
+            # cancelled meanwhile
+            return True
+        stale = datetime.utcnow() - timedelta(seconds=MOVE_TIMEOUT)
+        if not lock.get("mover") or lock["moving_since"] > stale:
+            return False
+        if Queries.objects(id=self.id, bucketed=True).count():
+            # moved, the mover crashed before unlocking
+            return False
+
+        # only one request cancels it
+        if not ResponseBuckets.objects(
+                question=self.id, index=0, mover=lock["mover"]).delete():
+            return False
+        ResponseBuckets.objects(
+            question=self.id, mover=lock["mover"]).delete()
+        return True
+
+    @classmethod
+    def get_responses(
+        cls, question_id: ObjectId, channel: str, page: int = 1,
+        page_size: int = 10,
+    ) -> Tuple[List[Dict], Dict[str, int]] | None:
+        """
+        Retrieve responses of a question with pagination, oldest first.
+        Args:
+            - question_id (ObjectId): id of the question
+            - channel (str): channel of the question
+            - page (int): Page number (default: 1).
+            - page_size (int): Number of items per page (default: 10).
+
+        Returns: A Tuple of list of responses and paginations data,
+            None when there is no such question
+        Note: only the page is read, a slice of the embedded responses
+            or the buckets covering it
+        """
+        page = max(page, 1)
+        skip_value = (page - 1) * page_size
+
+        question = cls._get_collection().find_one(
+            {"_id": ObjectId(question_id), "channel": channel},
+            {
+                "bucketed": 1,
+                "responses_count": 1,
+                "responses": {"$slice": [skip_value, page_size + 1]},
+            },
+        )
+        if not question:
+            return None
+
+        if question.get("bucketed"):
+            responses = ResponseBuckets.get_range(
+                question["_id"], skip_value, page_size + 1)
+        else:
+            responses = question.get("responses", [])
+
+        pagination = {
+            "page": page,
+            "prev_page": page - 1 if page > 1 else None,
+            "next_page": page + 1 if len(responses) > page_size else None,
+            "responses_count": question.get("responses_count", 0),
+        }
+        responses = [
+            {
+                "response_id": str(response["_id"]),
+                "question_id": str(question["_id"]),
+                **cls.__response_to_dict(response),
+            }
+            for response in responses[:page_size]
+        ]
+
+        author_summaries.embed([{"responses": responses}])
+
+        return responses, pagination
+
+    @classmethod
+    def find_response(cls, response_id: ObjectId) -> Dict | None:
+        """
+        method that finds a response and its question based on response id
+        params:
+            response_id (ObjectId): id of the response
+        Returns: the serialized response with the id and text of its
+            question, None when there is no such response
+        Note: one query on the responses._id index, only the matching
+            response is read ($elemMatch), a bucketed response needs one
+            more query (by id) for its question
+        """
+        response_id = ObjectId(response_id)
+        projection = {"responses": {"$elemMatch": {"_id": response_id}}}
+        question = None
+
+        if cls.responses_storage == "bucketed":
+            bucket = ResponseBuckets._get_collection().find_one(
+                {"responses._id": response_id},
+                {"question": 1, **projection},
+            )
+            if bucket:
+                question = cls._get_collection().find_one(
+                    {"_id": bucket["question"]}, {"query_text": 1})
+                if question:
+                    question["responses"] = bucket["responses"]
+
+        if not question:
+            question = cls._get_collection().find_one(
+                {"responses._id": response_id},
+                {"query_text": 1, **projection},
+            )
+        if not question:
+            return None
+
+        response = question["responses"][0]
+        responder = _ref(response.get("author"))
+
+        return {
+            "question_id": str(question["_id"]),
+            "question": question["query_text"],
+            "response_id": str(response_id),
+            "response": response.get("content"),
+            "responder": author_summaries.resolve([responder])[responder],
+            "created_at": _fmt(response.get("created_at")),
+            "updated_at": _fmt(response.get("updated_at")),
+        }
 
     @classmethod
     def get_queries(
-        cls, channel: str = "developer", page: int = 0, page_size: int = 10
+        cls, channel: str = "developer", page: int = 0, page_size: int = 10,
+        cursor: str = None,
     ) -> Tuple[List["Queries"], Dict[str, str]]:
         """
-        Retrieve queries with pagination.
+        Retrieve queries with pagination, newest first.
         Args:
             - channel (str): field to focus on
             - page (int): Page number (default: 1).
             - page_size (int): Number of items per page (default: 10).
+            - cursor (str): next_cursor/prev_cursor of a previous page,
+                takes precedence over page (keyset pagination)
 
         Returns: A Tuple of list of queries objects and paginations data
         """
-        # Calculate skip value based on page number and page size
-        skip_value = (page - 1) * page_size
-
         queries = None
 
         if channel == "all":
-            queries = cls.objects().skip(skip_value).limit(page_size + 1)
+            queries = cls.objects()
         else:
-            queries = cls.objects(
-                channel=channel).skip(skip_value).limit(page_size + 1)
+            queries = cls.objects(channel=channel)
 
-        queries_list = []
+        if cursor:
+            return cls.__get_queries_after(queries, cursor, page_size)
 
-        if queries:
-            for prompt in queries:
-                queries_list.append(prompt.to_dict())
+        page = max(page, 1)
+        # Calculate skip value based on page number and page size
+        skip_value = (page - 1) * page_size
+
+        # raw documents are serialized without building Queries objects
+        queries = queries.order_by("-created_at", "-id").skip(
+            skip_value).limit(page_size + 1).as_pymongo()
+
+        queries = list(queries)
 
         pagination = {
-            "page": page, "prev_page": page - 1 if page > 1 else None
+            "page": page, "prev_page": page - 1 if page > 1 else None,
+            "prev_cursor": None, "next_cursor": None,
             }
         # next page is valid
-        if len(queries_list) == page_size + 1:
-            queries_list = queries_list[:-1]
+        if len(queries) == page_size + 1:
+            queries = queries[:-1]
             pagination["next_page"] = page + 1
+            pagination["next_cursor"] = encode_cursor(
+                queries[-1]["created_at"], queries[-1]["_id"], "next")
         else:
             pagination["next_page"] = None
 
-        return (queries_list, pagination)
+        if page > 1 and queries:
+            pagination["prev_cursor"] = encode_cursor(
+                queries[0]["created_at"], queries[0]["_id"], "prev")
+
+        return (author_summaries.embed(
+            [cls.to_dict_raw(prompt) for prompt in queries]), pagination)
+
+    @classmethod
+    def __get_queries_after(
+        cls, queries, cursor: str, page_size: int
+    ) -> Tuple[List["Queries"], Dict[str, str]]:
+        """
+        keyset page of queries on (created_at, _id) next to a cursor
+        """
+        created_at, _id, direction = decode_cursor(cursor)
+
+        if direction == "next":
+            queries = queries.filter(
+                Q(created_at__lt=created_at)
+                | Q(created_at=created_at, id__lt=_id)
+            ).order_by("-created_at", "-id")
+        else:
+            queries = queries.filter(
+                Q(created_at__gt=created_at)
+                | Q(created_at=created_at, id__gt=_id)
+            ).order_by("created_at", "id")
+
+        queries = list(queries.limit(page_size + 1).as_pymongo())
+        has_more = len(queries) == page_size + 1
+        queries = queries[:page_size]
+
+        if direction == "prev":
+            queries.reverse()
+
+        pagination = {"page": None, "prev_page": None, "next_page": None,
+                      "prev_cursor": None, "next_cursor": None}
+
+        if queries and (has_more or direction == "prev"):
+            pagination["next_cursor"] = encode_cursor(
+                queries[-1]["created_at"], queries[-1]["_id"], "next")
+        if queries and (has_more or direction == "next"):
+            pagination["prev_cursor"] = encode_cursor(
+                queries[0]["created_at"], queries[0]["_id"], "prev")
+
+        return (author_summaries.embed(
+            [cls.to_dict_raw(prompt) for prompt in queries]), pagination)
+
+    @classmethod
+    def export(
+        cls, channel: str, since: datetime = None, batch_size: int = 500
+    ) -> Iterator[Dict]:
+        """
+        Stream every question of a channel with all its responses.
+        Args:
+            - channel (str): channel to export
+            - since (datetime): only questions updated or responded to
+                since then
+            - batch_size (int): documents fetched per round trip
+
+        Returns: generator of serialized questions, oldest first
+            (author ids are not resolved)
+        Note: questions come from one server-side cursor, memory does
+            not grow with the size of the channel
+        """
+        queries = cls.objects(channel=channel)
+        if since:
+            queries = queries.filter(
+                Q(updated_at__gte=since) | Q(last_response_at__gte=since))
+
+        queries = queries.order_by("id").batch_size(
+            batch_size).no_cache().as_pymongo()
+
+        for question in queries:
+            responses = question.get("responses") or []
+            if question.get("bucketed"):
+                responses = (
+                    response
+                    for bucket in ResponseBuckets.objects(
+                        question=question["_id"]
+                    ).order_by("index").only("responses").as_pymongo()
+                    for response in bucket.get("responses", [])
+                )
+
+            yield {
+                "question_id": str(question["_id"]),
+                **cls.to_dict_raw(question),
+                "responses": [
+                    {
+                        "response_id": str(response["_id"]),
+                        **cls.__response_to_dict(response),
+                    }
+                    for response in responses
+                ],
+            }
 
     @classmethod
     def get_user_questions_and_responses(
@@ -352,67 +1104,215 @@ class Queries(Document, Base):
         Returns:
         - Tuple containing user's questions with responses
             and questions responded to.
+        Note: both lists come from one aggregation, only the user's own
+            responses of the responded questions leave the server. The
+            questions are streamed (no single result document), so long
+            lists are not limited to 16MB
         """
-        user_questions = None
-        question_title = question_title.lower()
+        user_id = ObjectId(user_id)
+        queries = cls.objects(
+            Q(author=user_id) | Q(responses__author=user_id), channel=channel
+        )
         if question_title:
-            user_questions = cls.objects(
-                author=user_id, channel=channel, query_title=question_title
-            )
+            queries = queries.filter(query_title=question_title.lower())
         elif _id:
-            user_questions = cls.objects(
-                author=user_id, channel=channel, _id=ObjectId(_id)
-            )
-        else:
-            user_questions = cls.objects(author=user_id, channel=channel)
+            queries = queries.filter(id=ObjectId(_id))
 
         # Questions posted by the user
         user_questions_with_responses = []
-        for question in user_questions:
-            question_data = question.to_dict()
-
-            user_questions_with_responses.append(question_data)
-
         # Questions the user responded to with their responses
-        responded_questions = None
-        if question_title:
-            responded_questions = cls.objects(
-                responses__author=user_id,
-                channel=channel,
-                query_title=question_title
-            )
-        elif _id:
-            responded_questions = cls.objects(
-                responses__author=user_id, channel=channel, _id=ObjectId(_id)
-            )
-        else:
-            responded_questions = cls.objects(
-                responses__author=user_id, channel=channel
-            )
-
         responded_questions_with_responses = []
-        for question in responded_questions:
-            responses = []
-            for response in question.responses:
-                if response.author == user_id:
-                    response_data = {
-                        "response_id": str(response._id),
-                        "content": response.content,
-                        "author": response.author,
-                        "created_at": response.created_at.strftime(STRFTIME),
-                        "updated_at": response.updated_at.strftime(STRFTIME),
-                    }
-                    responses.append(response_data)
-
-            question_data = {
-                "question_id": str(question.id),
-                "title": question.title,
-                "query_text": question.query_text,
-                "responses": responses,
-                "created_at": question.created_at.strftime(STRFTIME),
-                "updated_at": question.updated_at.strftime(STRFTIME),
-            }
-            responded_questions_with_responses.append(question_data)
+
+        for question in queries.aggregate([
+            {"$sort": {"_id": 1}},
+            {"$addFields": {
+                "own_responses": {"$filter": {
+                    "input": "$responses",
+                    "as": "response",
+                    "cond": {"$eq": ["$$response.author", user_id]},
+                }},
+                # responses of others only leave with the user's questions
+                "responses": {"$cond": [
+                    {"$eq": ["$author", user_id]}, "$responses", []]},
+            }},
+        ]):
+            own_responses = question.pop("own_responses")
+            if question["author"] == user_id:
+                user_questions_with_responses.append(
+                    cls.to_dict_raw(question))
+            if own_responses:
+                question["responses"] = own_responses
+                responded_questions_with_responses.append(
+                    cls.__responded_to_dict(question, user_id))
+
+        if cls.responses_storage == "bucketed":
+            responded_questions_with_responses += [
+                cls.__responded_to_dict(question, user_id)
+                for _, question in cls.__responded_in_buckets(
+                    [user_id], channel, question_title, _id)
+            ]
+            responded_questions_with_responses.sort(
+                key=lambda question: question["question_id"])
+
+        # authors of both lists are resolved with one batch
+        author_summaries.embed(
+            user_questions_with_responses + responded_questions_with_responses)
 
         return (user_questions_with_responses,
                 responded_questions_with_responses)
+
+    @classmethod
+    def get_users_questions_and_responses(
+        cls, user_ids: List[ObjectId], channel: str
+    ) -> Dict[str, Tuple[list, list]]:
+        """
+        Batched get_user_questions_and_responses for several users.
+
+        Args:
+        - user_ids (list): IDs of the users.
+        - channel (str): channel to target
+
+        Returns:
+        - dict of user id (str) to the Tuple returned by
+            get_user_questions_and_responses
+        Note: one aggregation for all users, grouped by author while
+            the questions are streamed (no single result document)
+        """
+        user_ids = [ObjectId(_) for _ in user_ids]
+        data = {str(_): ([], []) for _ in user_ids}
+        if not user_ids:
+            return data
+
+        queries = cls.objects(
+            Q(author__in=user_ids) | Q(responses__author__in=user_ids),
+            channel=channel,
+        )
+
+        for question in queries.aggregate([
+            {"$sort": {"_id": 1}},
+            {"$addFields": {
+                "own_responses": {"$filter": {
+                    "input": "$responses",
+                    "as": "response",
+                    "cond": {"$in": ["$$response.author", user_ids]},
+                }},
+                # responses of others only leave with the users' questions
+                "responses": {"$cond": [
+                    {"$in": ["$author", user_ids]}, "$responses", []]},
+            }},
+        ]):
+            own_responses = question.pop("own_responses") or []
+            if question["author"] in user_ids:
+                data[str(question["author"])][0].append(
+                    cls.to_dict_raw(question))
+
+            by_author = {}
+            for response in own_responses:
+                by_author.setdefault(response["author"], []).append(response)
+            for author, responses in by_author.items():
+                question["responses"] = responses
+                data[str(author)][1].append(
+                    cls.__responded_to_dict(question, author))
+
+        if cls.responses_storage == "bucketed":
+            for author, question in cls.__responded_in_buckets(
+                    user_ids, channel):
+                data[str(author)][1].append(
+                    cls.__responded_to_dict(question, author))
+            for _, responded in data.values():
+                responded.sort(key=lambda question: question["question_id"])
+
+        author_summaries.embed([
+            question
+            for questions in data.values()
+            for part in questions
+            for question in part
+        ])
+
+        return data
+
+    @classmethod
+    def __responded_in_buckets(
+        cls,
+        user_ids: List[ObjectId],
+        channel: str,
+        question_title: str = None,
+        _id: ObjectId = None,
+    ) -> List[Tuple[ObjectId, Dict]]:
+        """
+        bucketed questions the users responded to, with only their
+        responses, as (author, raw question) pairs
+        """
+        match = {"channel": channel, "responses.author": {"$in": user_ids}}
+        if _id:
+            match["question"] = ObjectId(_id)
+
+        groups = list(ResponseBuckets.objects.aggregate([
+            {"$match": match},
+            {"$sort": {"question": 1, "index": 1}},
+            {"$unwind": "$responses"},
+            {"$match": {"responses.author": {"$in": user_ids}}},
+            {"$group": {
+                "_id": {
+                    "author": "$responses.author",
+                    "question": "$question",
+                },
+                "responses": {"$push": "$responses"},
+            }},
+        ]))
+        if not groups:
+            return []
+
+        questions = cls.objects(
+            id__in=list({group["_id"]["question"] for group in groups}),
+            channel=channel,
+        )
+        if question_title:
+            questions = questions.filter(query_title=question_title.lower())
+        questions = {
+            question["_id"]: question
+            for question in questions.only(
+                "title", "query_text", "created_at", "updated_at"
+            ).as_pymongo()
+        }
+
+        return [
+            (group["_id"]["author"], {
+                **questions[group["_id"]["question"]],
+                "responses": group["responses"],
+            })
+            for group in groups
+            if group["_id"]["question"] in questions
+        ]
+
+    @staticmethod
+    def __responded_to_dict(question: Dict, user_id: ObjectId) -> Dict:
+        """
+        serializes a raw responded question (with only the user's responses)
+        """
+        return {
+            "question_id": str(question["_id"]),
+            "title": question["title"],
+            "query_text": question["query_text"],
+            "responses": [
+                {
+                    "response_id": str(response["_id"]),
+                    **Queries.__response_to_dict(response),
+                }
+                for response in question["responses"]
+            ],
+            "created_at": question["created_at"].strftime(STRFTIME),
+            "updated_at": question["updated_at"].strftime(STRFTIME),
+        }
+
+    @staticmethod
+    def __response_to_dict(response: Dict) -> Dict:
+        """
+        serializes a raw response (without its id)
+        """
+        return {
+            "content": response.get("content"),
+            "author": _ref(response.get("author")),
+            "created_at": _fmt(response.get("created_at")),
+            "updated_at": _fmt(response.get("updated_at")),
+        }
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Module for password hashing (Uses bcrypt)
+"""
+import bcrypt
+import multiprocessing
+import os
+import threading
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    TimeoutError,
+)
+from typing import Callable, List
+
+
+def _hashpw(password: str, rounds: int) -> str:
+    """
+    bcrypt hash of a password (runs in the threads or processes of
+    hash_many)
+    """
+    return bcrypt.hashpw(
+        password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+class HashingPoolBusy(Exception):
+    """
+    raised when the hashing pool has no free worker or queue slot, or
+    when a job waited longer than the timeout
+    """
+
+
+class PasswordHasher:
+    """
+    class for running bcrypt work on a bounded pool of threads
+    Note: bcrypt releases the GIL while hashing, so threads are enough
+        to use several cores. At most workers + queue_depth jobs are
+        admitted at once, further jobs are rejected straight away
+        instead of piling up behind a burst of logins
+    """
+
+    def __init__(self, rounds: int = 12, workers: int = 4,
+                 queue_depth: int = 16, timeout: float = 10,
+                 bulk_workers: int = 2) -> None:
+        self.__lock = threading.Lock()
+        self.__pid = None
+        self.__executor = None
+        self.__bulk_executor = None
+        self.configure(rounds, workers, queue_depth, timeout, bulk_workers)
+
+    def configure(self, rounds: int = None, workers: int = None,
+                  queue_depth: int = None, timeout: float = None,
+                  bulk_workers: int = None) -> None:
+        """
+        A method to (re)configure the work factor and pool bounds
+        Args:
+            rounds (int): bcrypt work factor for new hashes
+            workers (int): number of hashing threads
+            queue_depth (int): jobs allowed to wait for a thread
+            timeout (float): seconds a caller waits for its result
+            bulk_workers (int): number of threads shared by hash_many
+        """
+        with self.__lock:
+            if rounds:
+                self.rounds = rounds
+            if workers:
+                self.workers = workers
+            if queue_depth is not None:
+                self.queue_depth = queue_depth
+            if timeout:
+                self.timeout = timeout
+            if bulk_workers:
+                self.bulk_workers = bulk_workers
+
+            self.__slots = threading.BoundedSemaphore(
+                self.workers + self.queue_depth)
+            if self.__executor and self.__pid == os.getpid():
+                self.__executor.shutdown(wait=False)
+                self.__bulk_executor.shutdown(wait=False)
+            self.__pid = None
+            self.__executor = None
+            self.__bulk_executor = None
+
+    def hash(self, password: str) -> str:
+        """
+        A method to hash a password with the configured work factor
+        Args:
+            password (str): password to hash
+        Return: bcrypt hash
+        """
+        hashed = self.__run(
+            bcrypt.hashpw, password.encode("utf-8"),
+            bcrypt.gensalt(self.rounds)
+        )
+
+        return hashed.decode("utf-8")
+
+    def hash_many(self, passwords: List[str],
+                  workers: int = None) -> List[str]:
+        """
+        A method to hash many passwords at once (bulk provisioning)
+        Args:
+            passwords (list): passwords to hash
+            workers (int): number of processes to spawn (command line
+                only), not set: the bulk threads of the process
+        Return: bcrypt hashes, in the order of the passwords
+        Note: both run outside of the bounded pool serving logins. The
+            bulk threads are shared by every request of the process, so
+            concurrent batches queue instead of adding threads.
+            Processes are spawned rather than forked, forking a threaded
+            server is not safe
+        """
+        if not workers:
+            return list(self.__pool(bulk=True).map(
+                _hashpw, passwords, [self.rounds] * len(passwords)))
+
+        workers = min(workers, len(passwords))
+
+        if workers <= 1:
+            return [_hashpw(password, self.rounds) for password in passwords]
+
+        with ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            return list(executor.map(
+                _hashpw, passwords, [self.rounds] * len(passwords),
+                chunksize=max(1, len(passwords) // (workers * 4)),
+            ))
+
+    def check(self, password: str, hashed: str) -> bool:
+        """
+        A method to verify a password against its hash
+        Args:
+            password (str): password to assert
+            hashed (str): bcrypt hash to check against
+        Returns (bool): True if equal otherwise false
+        """
+        return self.__run(
+            bcrypt.checkpw, password.encode("utf-8"), hashed.encode("utf-8")
+        )
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """
+        A method to check if a hash uses another work factor
+        Args:
+            hashed (str): bcrypt hash ("$2b$<cost>$...")
+        """
+        try:
+            return int(hashed.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def __run(self, func: Callable, *args):
+        """
+        submits a job to the pool and waits for its result
+        """
+        slots = self.__slots
+
+        if not slots.acquire(blocking=False):
+            raise HashingPoolBusy("Password hashing pool is saturated")
+
+        try:
+            future = self.__pool().submit(func, *args)
+        except Exception:
+            slots.release()
+            raise
+
+        future.add_done_callback(lambda _: slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # the job keeps its slot until it finishes
+            raise HashingPoolBusy("Password hashing took too long")
+
+    def __pool(self, bulk: bool = False) -> ThreadPoolExecutor:
+        """
+        executor for the current process (created after fork), the
+        bounded one or the bulk one
+        """
+        pid = os.getpid()
+
+        if self.__pid != pid:
+            with self.__lock:
+                if self.__pid != pid:
+                    self.__executor = ThreadPoolExecutor(
+                        self.workers, thread_name_prefix="bcrypt")
+                    self.__bulk_executor = ThreadPoolExecutor(
+                        self.bulk_workers, thread_name_prefix="bcrypt-bulk")
+                    self.__pid = pid
+
+        return self.__bulk_executor if bulk else self.__executor
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Module for generating the to_dict serializers of documents
+Note: the code of each serializer is generated once per class from its
+    __attributes list, so serializing a document costs plain dict
+    lookups instead of reflection on every field
+"""
+from operator import attrgetter
+from typing import Callable, List
+
+from mongoengine import (
+    DateTimeField,
+    EmbeddedDocumentField,
+    EmbeddedDocumentListField,
+    ReferenceField,
+)
+
+STRFTIME = "%Y-%m-%d %H:%M:%S"
+
+
+def _fmt(value):
+    """
+    formats a datetime (None stays None)
+    """
+    return None if value is None else value.strftime(STRFTIME)
+
+
+def _ref(value):
+    """
+    id (str) of a reference, whether a document, DBRef or ObjectId
+    """
+    if value is None:
+        return None
+    return str(getattr(value, "id", value))
+
+
+_data = attrgetter("_data")
+
+
+def _value(field, src: str, raw: bool) -> str:
+    """
+    expression reading a field from the src dict
+    """
+    key = field.db_field if raw else field.name
+    default = field.default
+
+    if raw and default is not None and not callable(default):
+        value = f"{src}.get({key!r}, {default!r})"
+    else:
+        value = f"{src}.get({key!r})"
+
+    if isinstance(field, DateTimeField):
+        return f"_fmt({value})"
+    if isinstance(field, ReferenceField):
+        return f"_ref({value})"
+    return value
+
+
+def _embedded(document, names: List[str], src: str, raw: bool) -> str:
+    """
+    dict display of an embedded document read from src
+    """
+    items = ", ".join(
+        f"{name!r}: {_value(document._fields[name], src, raw)}"
+        for name in names
+    )
+    return "{" + items + "}"
+
+
+def compile_serializer(cls, attrs: List, raw: bool = False) -> Callable:
+    """
+    generates the serializer of a document class
+    Args:
+        cls: Document class
+        attrs (list): __attributes of the class (field names, and dicts
+            of embedded field names to their own field names)
+        raw (bool): serialize raw documents (as_pymongo() dicts) instead
+            of document instances
+    Return: function taking a document (or a raw dict) returning a dict
+    """
+    lines = ["d = obj" if raw else "d = obj._data"]
+    items = []
+
+    for key in attrs:
+        if type(key) is str:
+            items.append(f"{key!r}: {_value(cls._fields[key], 'd', raw)}")
+            continue
+
+        for name, names in key.items():
+            field = cls._fields[name]
+            value = f"d.get({(field.db_field if raw else name)!r})"
+
+            if isinstance(field, EmbeddedDocumentListField):
+                document = field.field.document_type
+                rows = f"({value} or [])" if raw else \
+                    f"map(_data, {value} or [])"
+                items.append(
+                    f"{name!r}: [{_embedded(document, names, 'e', raw)} "
+                    f"for e in {rows}]"
+                )
+            elif isinstance(field, EmbeddedDocumentField):
+                document = field.document_type
+                lines.append(f"e_{name} = {value}")
+                if not raw:
+                    lines.append(
+                        f"e_{name} = e_{name} and e_{name}._data")
+                items.append(
+                    f"{name!r}: None if e_{name} is None else "
+                    f"{_embedded(document, names, f'e_{name}', raw)}"
+                )
+
+    name = "to_dict_raw" if raw else "to_dict"
+    source = f"def {name}(obj):\n"
+    source += "".join(f"    {line}\n" for line in lines)
+    source += "    return {" + ", ".join(items) + "}\n"
+
+    namespace = {"_fmt": _fmt, "_ref": _ref, "_data": _data}
+    exec(compile(source, f"<{cls.__name__}.{name}>", "exec"), namespace)
+
+    serializer = namespace[name]
+    serializer.__doc__ = f"serializes a {cls.__name__} " + (
+        "raw document (as_pymongo)" if raw else "document") + " to a dict"
+    serializer.source = source
+
+    return serializer
@@ -4,4 +4,5 @@ Module for starting the API
 """
 from api.app import app
 
-app.run("127.0.0.1", 5000)
+if __name__ == "__main__":
+    app.run("127.0.0.1", 5000)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+tests of Queries.get_user_questions_and_responses (on mongomock)
+"""
+import unittest
+import mongoengine
+import mongomock
+from db.docs import Queries, Responses, Users
+
+# already hashed, so that saving users does not run bcrypt
+PASSWORD = "$2b$04$" + "a" * 53
+
+
+class TestUserQuestionsAndResponses(unittest.TestCase):
+    """
+    questions of a user and questions they responded to
+    """
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        mongoengine.connect(
+            "consulthub-tests", host="mongodb://localhost",
+            mongo_client_class=mongomock.MongoClient, alias="default")
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        mongoengine.disconnect(alias="default")
+
+    def setUp(self) -> None:
+        Queries.responses_storage = "embedded"
+        self.alice, self.bob = [
+            Users(username=f"{name}tester", email=f"{name}tester@gmail.com",
+                  password=PASSWORD, field="developer").save()
+            for name in ("alice", "bob")
+        ]
+        self.own = Queries(
+            title="How does caching work", query_text="Explain caching",
+            channel="developer", author=self.alice,
+            responses=[
+                Responses(content="bob answers", author=self.bob),
+                Responses(content="alice follows up", author=self.alice),
+            ],
+        ).save()
+        self.other = Queries(
+            title="What is an index", query_text="Explain indexes",
+            channel="developer", author=self.bob,
+            responses=[
+                Responses(content="bob again", author=self.bob),
+                Responses(content="alice answers", author=self.alice),
+            ],
+        ).save()
+        # neither posted nor responded to by alice
+        Queries(
+            title="Why use queues", query_text="Explain queues",
+            channel="developer", author=self.bob,
+            responses=[Responses(content="bob alone", author=self.bob)],
+        ).save()
+
+    def tearDown(self) -> None:
+        Queries.drop_collection()
+        Users.drop_collection()
+
+    def test_user_questions_keep_every_response(self) -> None:
+        """the user's questions come with all their responses"""
+        user_questions, _ = Queries.get_user_questions_and_responses(
+            self.alice.id, "developer")
+
+        self.assertEqual(
+            [_["title"] for _ in user_questions], ["How does caching work"])
+        self.assertEqual(
+            [(_["content"], _["author"]["username"])
+             for _ in user_questions[0]["responses"]],
+            [("bob answers", "bobtester"),
+             ("alice follows up", "alicetester")],
+        )
+        self.assertEqual(user_questions[0]["author"]["username"],
+                         "alicetester")
+
+    def test_responded_questions_keep_own_responses(self) -> None:
+        """responded questions only carry the user's responses"""
+        _, responded = Queries.get_user_questions_and_responses(
+            self.alice.id, "developer")
+
+        self.assertEqual(
+            [_["question_id"] for _ in responded],
+            [str(self.own.id), str(self.other.id)])
+        self.assertEqual(
+            [[response["content"] for response in _["responses"]]
+             for _ in responded],
+            [["alice follows up"], ["alice answers"]],
+        )
+        self.assertEqual(
+            responded[1]["responses"][0]["response_id"],
+            str(self.other.responses[1]._id))
+
+    def test_filter_by_title(self) -> None:
+        """a title limits both lists to that question"""
+        user_questions, responded = Queries.get_user_questions_and_responses(
+            self.alice.id, "developer", question_title="What Is An Index")
+
+        self.assertEqual(user_questions, [])
+        self.assertEqual(
+            [_["question_id"] for _ in responded], [str(self.other.id)])
+
+    def test_batched_matches_single_user(self) -> None:
+        """the batched version returns the same lists per user"""
+        data = Queries.get_users_questions_and_responses(
+            [self.alice.id, self.bob.id], "developer")
+
+        for user in (self.alice, self.bob):
+            self.assertEqual(
+                data[str(user.id)],
+                Queries.get_user_questions_and_responses(
+                    user.id, "developer"))
+        self.assertEqual(len(data[str(self.bob.id)][1]), 3)
+
+    def test_unknown_channel(self) -> None:
+        """nothing is returned for another channel"""
+        self.assertEqual(
+            Queries.get_user_questions_and_responses(self.alice.id, "art"),
+            ([], []))
+
+
+if __name__ == "__main__":
+    unittest.main()